@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Write time and bytes on disk of synthetic Transactions records as Singer
+# JSON lines (plain and gzip compressed) against the columnar side output
+# in each format available here.
+#
+#   python benchmarks/columnar.py
+
+import os
+import sys
+import gzip
+import time
+import random
+import shutil
+import tempfile
+import singer
+import tap_awin
+from tap_awin import transform
+from tap_awin.columnar import ColumnarSink, pyarrow
+from tap_awin.writer import encode
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stubserver import transaction
+
+ROWS = 20000
+WINDOW = '2017-12-08T23:59:59+00:00'
+STAMPS = {'startDate': '2017-12-08 00:00:00+00:00', 'endDate': '2017-12-08 00:00:00+00:00'}
+
+
+def records():
+    rng = random.Random(1)
+    reshape = transform.compile_transform(tap_awin.TRANSACTION_STEPS,
+                                          dict(STAMPS, datasettype='advertiser'),
+                                          explode='transactionParts')
+    return [dict(record) for i in range(ROWS)
+            for record in reshape(transaction(rng, i, 1000))]
+
+
+def size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def jsonlines(rows, path, opener):
+    with opener(path, 'wb') as output:
+        for record in rows:
+            output.write(encode(singer.RecordMessage(stream='Transactions', record=record)))
+
+
+def columnar(rows, path, fileformat):
+    sink = ColumnarSink(path, ['Transactions'], fileformat)
+    for record in rows:
+        sink.write('Transactions', tap_awin.TRANSACTION_SCHEMA, WINDOW, record)
+    sink.close(WINDOW)
+
+
+def main():
+    rows = records()
+    directory = tempfile.mkdtemp()
+    outputs = [('json lines', lambda path: jsonlines(rows, path, open)),
+               ('json lines gzip', lambda path: jsonlines(rows, path, gzip.open))]
+    for fileformat in (['parquet', 'arrow'] if pyarrow is not None else []) + ['csv']:
+        outputs.append((fileformat, lambda path, fileformat=fileformat:
+                        columnar(rows, path, fileformat)))
+    try:
+        for number, (name, write) in enumerate(outputs):
+            path = os.path.join(directory, str(number))
+            start = time.perf_counter()
+            write(path)
+            elapsed = time.perf_counter() - start
+            print('%-16s %8d records %8.2fus/record %10d bytes %6.1f bytes/record' %
+                  (name, len(rows), elapsed / len(rows) * 1e6, size(path),
+                   size(path) / float(len(rows))))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
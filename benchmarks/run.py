@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Runs tap_awin.main against the synthetic API in benchmarks/stubserver.py and
+# reports records/sec, wall time and request count per stream plus the peak
+# RSS of the tap process.
+#
+#   python benchmarks/run.py --advertisers 50 --transactions 2000 --latency 0.05 \
+#       --tap_config '{"max_workers": 4, "max_streams": 4}'
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stubserver import AwinStub
+
+TAP_CONFIG = {"accessToken": "benchmark", "user_agent": "tap-awin-benchmark",
+              "start_date": "2017-12-07T00:00:00Z", "increment": 1,
+              "relationship": "joined", "countryCode": "IE", "dateType": "transaction",
+              "timezone": "UTC", "status": "pending", "region": "IE",
+              "rate_limit": 1000000}
+
+
+def runtap(config, arguments):
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as configfile:
+        json.dump(config, configfile)
+    records = Counter()
+    first = {}
+    last = {}
+    try:
+        started = time.monotonic()
+        tap = subprocess.Popen([sys.executable, '-c', 'import tap_awin; tap_awin.main()',
+                                '--config', configfile.name] + arguments,
+                               stdout=subprocess.PIPE)
+        for line in tap.stdout:
+            message = json.loads(line.decode('utf-8'))
+            if message['type'] == 'RECORD':
+                now = time.monotonic()
+                stream = message['stream']
+                records[stream] += 1
+                first.setdefault(stream, now)
+                last[stream] = now
+        _, status, usage = os.wait4(tap.pid, 0)
+        tap.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) \
+                         else -os.WTERMSIG(status)
+        wall = time.monotonic() - started
+    finally:
+        os.remove(configfile.name)
+    return tap.returncode, wall, records, first, last, usage.ru_maxrss
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--advertisers', type=int, default=10)
+    parser.add_argument('--publishers', type=int, default=1)
+    parser.add_argument('--transactions', type=int, default=1000,
+                        help='Transactions per account and day')
+    parser.add_argument('--reportrows', type=int, default=50,
+                        help='Report rows per account and day')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added per request')
+    parser.add_argument('--error_rate', type=float, default=0.0,
+                        help='Share of requests answered with 429')
+    parser.add_argument('--related', type=float, default=1.0,
+                        help='Share of advertisers each publisher has joined')
+    parser.add_argument('--quota', type=int, help='Calls per minute, more are answered with 429')
+    parser.add_argument('--tap_config', default='{}',
+                        help='JSON merged into the generated tap config')
+    parser.add_argument('tap_arguments', nargs='*',
+                        help='Extra tap arguments, after --, e.g. -- --backfill')
+    args = parser.parse_args()
+
+    server = AwinStub(advertisers=args.advertisers, publishers=args.publishers,
+                      transactions=args.transactions, reportrows=args.reportrows,
+                      latency=args.latency, error_rate=args.error_rate,
+                      related=args.related, quota=args.quota).start()
+    config = dict(TAP_CONFIG, api_url=server.url, **json.loads(args.tap_config))
+    try:
+        returncode, wall, records, first, last, maxrss = runtap(config, args.tap_arguments)
+    finally:
+        server.stop()
+
+    print('%-20s %10s %10s %14s %10s' % ('stream', 'records', 'seconds', 'records/sec',
+                                         'requests'))
+    for stream in sorted(set(records) | set(server.requests)):
+        seconds = last.get(stream, 0) - first.get(stream, 0)
+        print('%-20s %10d %10.2f %14.0f %10d' %
+              (stream, records[stream], seconds,
+               records[stream] / seconds if seconds else 0, server.requests[stream]))
+    total = sum(records.values())
+    print('%-20s %10d %10.2f %14.0f %10d' % ('total', total, wall, total / wall,
+                                             sum(server.requests.values())))
+    if args.quota:
+        print('%d calls over the quota of %d/minute, %.0f calls/minute' %
+              (server.rejected, args.quota, sum(server.requests.values()) * 60.0 / wall))
+    print('peak RSS %.1f MB, exit code %d' % (maxrss / 1024.0, returncode))
+    sys.exit(returncode)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# Local stand-in for the Awin endpoints used by tap_awin, serving synthetic
+# data of configurable volume with optional latency, 429 injection and a per
+# minute call quota answered with 429 like the real API's. Each
+# publisher has joined a share of the advertisers, pairs without that
+# relationship answer 404 like the real API.
+#
+#   python benchmarks/stubserver.py --port 8080 --advertisers 50 --transactions 1000
+
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from datetime import datetime
+from collections import Counter, deque
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+ROUTES = [('Accounts', re.compile(r'^/accounts$')),
+          ('Programmes', re.compile(r'^/publishers/(\d+)/programmes$')),
+          ('ProgrammesDetails', re.compile(r'^/publishers/(\d+)/programmedetails$')),
+          ('Commissiongroup', re.compile(r'^/publishers/(\d+)/commissiongroups$')),
+          ('Transactions', re.compile(r'^/(advertisers|publishers)/(\d+)/transactions/?$')),
+          ('AggReport', re.compile(r'^/advertisers/(\d+)/reports/publisher$')),
+          ('AggReport', re.compile(r'^/publishers/(\d+)/reports/advertiser$')),
+          ('AggReportCreative', re.compile(r'^/(advertisers|publishers)/(\d+)/reports/creative$'))]
+
+
+def days(query):
+    # Whole days covered by startDate..endDate, transactions send date-times
+    # and reports plain dates.
+    try:
+        start, end = [datetime.strptime(query[name][0][:10], '%Y-%m-%d')
+                      for name in ['startDate', 'endDate']]
+    except (KeyError, ValueError):
+        return 1
+    return max(1, (end - start).days + 1)
+
+
+def transaction(rng, i, account):
+    parts = [{"commissionGroupId": group, "amount": round(rng.uniform(1, 100), 2),
+              "commissionAmount": round(rng.uniform(0, 10), 2)}
+             for group in range(1, rng.randint(1, 3) + 1)]
+    return {"id": i, "url": "https://example.com/" + str(i), "advertiserId": account,
+            "publisherId": rng.randint(1, 1000), "siteName": "site",
+            "commissionStatus": rng.choice(["pending", "approved", "declined"]),
+            "commissionAmount": {"amount": round(rng.uniform(0, 10), 2), "currency": "EUR"},
+            "saleAmount": {"amount": round(rng.uniform(1, 100), 2), "currency": "EUR"},
+            "ipHash": None, "customerCountry": "IE",
+            "clickRefs": {"clickRef": "ref" + str(i)},
+            "clickDate": "2017-12-07T10:00:00", "transactionDate": "2017-12-07T10:05:00",
+            "validationDate": None, "type": "Commission group transaction",
+            "declineReason": None, "voucherCodeUsed": False, "voucherCode": None,
+            "lapseTime": rng.randint(1, 1000), "amended": False, "amendReason": None,
+            "oldSaleAmount": None, "oldCommissionAmount": None, "clickDevice": "Windows",
+            "transactionDevice": "Windows", "publisherUrl": None, "advertiserCountry": "IE",
+            "orderRef": str(i), "customParameters": [{"key": "k", "value": str(i)}],
+            "transactionParts": parts, "paidToPublisher": False, "paymentId": 0,
+            "transactionQueryId": 0, "originalSaleAmount": None}
+
+
+def reportrow(rng, advertiser, publisher, creative=None):
+    row = {"advertiserId": advertiser, "advertiserName": "Advertiser " + str(advertiser),
+           "publisherId": publisher, "publisherName": "Publisher " + str(publisher),
+           "region": "IE", "currency": "EUR",
+           "impressions": rng.randint(0, 10000), "clicks": rng.randint(0, 1000)}
+    for kind in ['pending', 'confirmed', 'bonus', 'total', 'declined']:
+        row[kind + 'No'] = rng.randint(0, 50)
+        row[kind + 'Value'] = round(rng.uniform(0, 1000), 2)
+        row[kind + 'Comm'] = round(rng.uniform(0, 100), 2)
+    if creative is not None:
+        row.update({"creativeId": creative, "creativeName": "Creative " + str(creative),
+                    "tagName": "tag"})
+    return row
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        for stream, route in ROUTES:
+            match = route.match(url.path)
+            if match:
+                break
+        else:
+            return self.reply(404, {'error': 'Not found'})
+        server.count(stream)
+        if server.latency:
+            time.sleep(server.latency)
+        if server.throttled():
+            return self.reply(429, {'error': 'Too many requests'}, {'Retry-After': '0'})
+        if server.overquota():
+            return self.reply(429, {'error': 'Call quota exceeded'}, {'Retry-After': '1'})
+        ids = [int(i) for i in match.groups() if i and i.isdigit()]
+        if stream in ('ProgrammesDetails', 'Commissiongroup') and \
+           int(query.get('advertiserId', ['0'])[0]) not in server.joined(ids[0]):
+            return self.reply(404, {'error': 'No relationship with this advertiser'})
+        self.reply(200, server.body(stream, url.path, ids, query))
+
+    def reply(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class AwinStub(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), advertisers=10, publishers=1, transactions=100,
+                 reportrows=20, latency=0.0, error_rate=0.0, related=1.0, seed=1, quota=None):
+        HTTPServer.__init__(self, address, Handler)
+        self.advertisers = [1000 + i for i in range(advertisers)]
+        self.publishers = [9000 + i for i in range(publishers)]
+        self.transactions = transactions
+        self.reportrows = reportrows
+        self.latency = latency
+        self.error_rate = error_rate
+        self.related = related
+        self.quota = quota
+        self.calls = deque()
+        self.rejected = 0
+        self.seed = seed
+        self.errors = random.Random(seed)
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def random(self, *key):
+        return random.Random(zlib.crc32(repr((self.seed,) + key).encode('utf-8')))
+
+    def joined(self, publisher):
+        return [i for i in self.advertisers
+                if self.random('joined', publisher, i).random() < self.related]
+
+    def handle_error(self, request, client_address):
+        # The tap drops its keep-alive connections when it exits.
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            HTTPServer.handle_error(self, request, client_address)
+
+    def throttled(self):
+        with self.lock:
+            return self.error_rate > 0 and self.errors.random() < self.error_rate
+
+    def overquota(self):
+        # At most `quota` calls in any 60 seconds.
+        if not self.quota:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            while self.calls and self.calls[0] <= now - 60:
+                self.calls.popleft()
+            if len(self.calls) >= self.quota:
+                self.rejected += 1
+                return True
+            self.calls.append(now)
+            return False
+
+    def count(self, stream):
+        with self.lock:
+            self.requests[stream] += 1
+
+    def body(self, stream, path, ids, query):
+        rng = self.random(path, tuple(sorted((k, tuple(v)) for k, v in query.items())))
+        if stream == 'Accounts':
+            return {'userId': 1, 'accounts':
+                    [{'accountId': i, 'accountName': 'Advertiser ' + str(i),
+                      'accountType': 'advertiser', 'userRole': 'admin'}
+                     for i in self.advertisers] +
+                    [{'accountId': i, 'accountName': 'Publisher ' + str(i),
+                      'accountType': 'publisher', 'userRole': 'admin'}
+                     for i in self.publishers]}
+        if stream == 'Programmes':
+            advertisers = self.joined(ids[0]) if query.get('relationship') == ['joined'] \
+                          else self.advertisers
+            return [{'id': i, 'name': 'Advertiser ' + str(i), 'displayUrl': 'example.com',
+                     'clickThroughUrl': 'https://example.com', 'logoUrl': None,
+                     'primaryRegion': {'name': 'Ireland', 'countryCode': 'IE'},
+                     'currencyCode': 'EUR'} for i in advertisers]
+        if stream == 'ProgrammesDetails':
+            advertiser = int(query.get('advertiserId', ['0'])[0])
+            return {'programmeInfo': {'id': advertiser, 'name': 'Advertiser ' + str(advertiser),
+                                      'displayUrl': 'example.com',
+                                      'primaryRegion': {'name': 'Ireland', 'countryCode': 'IE'},
+                                      'validDomains': [{'domain': 'example.com'}],
+                                      'currencyCode': 'EUR'},
+                    'kpi': {'averagePaymentTime': '30', 'approvalPercentage': 90,
+                            'epc': 0.5, 'conversionRate': 2.0, 'validationDays': 30,
+                            'awinIndex': 1.0},
+                    'commissionRange': [{'type': 'amount', 'min': 1, 'max': 10},
+                                        {'type': 'percentage', 'min': 1, 'max': 5}]}
+        if stream == 'Commissiongroup':
+            return [{'groupId': group, 'groupCode': 'CG' + str(group),
+                     'groupName': 'Group ' + str(group), 'type': 'percentage',
+                     'percentage': 5} for group in range(1, 4)]
+        if stream == 'Transactions':
+            count = self.transactions * days(query)
+            return [transaction(rng, ids[0] * 10000000 + rng.randint(0, 9999999), ids[0])
+                    for _ in range(count)]
+        creative = stream == 'AggReportCreative'
+        return [reportrow(rng, ids[0], 1 + i, i if creative else None)
+                for i in range(self.reportrows * days(query))]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--advertisers', type=int, default=10)
+    parser.add_argument('--publishers', type=int, default=1)
+    parser.add_argument('--transactions', type=int, default=100,
+                        help='Transactions per account and day')
+    parser.add_argument('--reportrows', type=int, default=20,
+                        help='Report rows per account and day')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added per request')
+    parser.add_argument('--error_rate', type=float, default=0.0,
+                        help='Share of requests answered with 429')
+    parser.add_argument('--related', type=float, default=1.0,
+                        help='Share of advertisers each publisher has joined')
+    parser.add_argument('--quota', type=int, help='Calls per minute, more are answered with 429')
+    args = parser.parse_args()
+    server = AwinStub(('127.0.0.1', args.port), args.advertisers, args.publishers,
+                      args.transactions, args.reportrows, args.latency, args.error_rate,
+                      args.related, quota=args.quota)
+    sys.stderr.write('Serving synthetic Awin API on ' + server.url + '\n')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# Records/sec of the Transactions reshaping, hand written dict surgery
+# (as before tap_awin.transform) against the compiled pipeline.
+#
+#   python benchmarks/transform.py
+
+import time
+from datetime import timedelta
+from pyrfc3339 import parse
+import tap_awin
+from tap_awin import transform
+
+ROWS = 20000
+LAST_FETCHED = '2017-12-07T23:59:59+00:00'
+INCREMENT = 1
+
+
+def transaction(i):
+    return {"id": i, "url": "https://example.com", "advertiserId": 1, "publisherId": 2,
+            "commissionStatus": "pending", "amended": False, "validationDate": None,
+            "commissionAmount": {"amount": 1.5, "currency": "EUR"},
+            "saleAmount": {"amount": 10.0, "currency": "EUR"},
+            "clickRefs": {"clickRef": "a", "clickRef2": "b"},
+            "customParameters": [{"key": "k", "value": "v"}, {"key": "l", "value": "w"}],
+            "transactionParts": [{"commissionGroupId": 1, "amount": 7.0,
+                                  "commissionAmount": 1.0},
+                                 {"commissionGroupId": 2, "amount": 3.0,
+                                  "commissionAmount": 0.5}]}
+
+
+def legacy(dataset, ttype, emit):
+    if 'commissionAmount' in dataset:
+        commamount = dataset['commissionAmount']['amount']
+        dataset['commissionCurrency'] = dataset['commissionAmount']['currency']
+        dataset.pop('commissionAmount')
+        dataset['commissionAmount'] = commamount
+    if 'saleAmount' in dataset:
+        saleamount = dataset['saleAmount']['amount']
+        dataset['saleCurrency'] = dataset['saleAmount']['currency']
+        dataset.pop('saleAmount')
+        dataset['saleAmount'] = saleamount
+    if 'clickRefs' in dataset and dataset['clickRefs'] != None:
+        dataset.update(dataset.pop('clickRefs'))
+    dataset['datasettype'] = ttype
+    if 'customParameters' in dataset and dataset['customParameters'] != None:
+        dataset['customParameters'] = str(dict([(i['key'], i['value']) \
+                                               for i in dataset['customParameters']]))
+    if  'transactionParts' in dataset:
+        transactionparts = [parts for parts in dataset['transactionParts']]
+        dataset.pop('transactionParts')
+    dataset["startDate"] = str(parse(LAST_FETCHED) + timedelta(days=1))
+    dataset["endDate"] = str(parse(LAST_FETCHED) + timedelta(days=INCREMENT))
+    for data in transactionparts:
+        dataset.update(data)
+        emit(dataset)
+
+
+def compiled(rows, emit):
+    base = parse(LAST_FETCHED)
+    reshape = transform.compile_transform(tap_awin.TRANSACTION_STEPS,
+                                          {'datasettype': 'advertiser',
+                                           'startDate': str(base + timedelta(days=1)),
+                                           'endDate': str(base + timedelta(days=INCREMENT))},
+                                          explode='transactionParts')
+    for row in rows:
+        for record in reshape(row):
+            emit(record)
+
+
+def measure(name, run):
+    rows = [transaction(i) for i in range(ROWS)]
+    emitted = []
+    start = time.perf_counter()
+    run(rows, emitted.append)
+    elapsed = time.perf_counter() - start
+    print('%-10s %8d records %8.3fs %12.0f records/sec' %
+          (name, len(emitted), elapsed, len(emitted) / elapsed))
+
+
+def main():
+    measure('legacy', lambda rows, emit: [legacy(row, 'advertiser', emit) for row in rows])
+    measure('compiled', compiled)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# Per record cost of the schema validation/coercion stage against the rest
+# of the per record work of the tap (parsing the streamed response,
+# reshaping and encoding the RECORD message) on synthetic Transactions and
+# AggReport rows as served by the stub server.
+#
+#   python benchmarks/validate.py
+
+import os
+import sys
+import json
+import time
+import random
+import singer
+import tap_awin
+from tap_awin import transform
+from tap_awin.cache import CachedResponse
+from tap_awin.client import iter_json_array
+from tap_awin.validate import compile_validator
+from tap_awin.writer import encode
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stubserver import transaction, reportrow
+
+ROWS = 20000
+STAMPS = {'startDate': '2017-12-08 00:00:00+00:00', 'endDate': '2017-12-08 00:00:00+00:00'}
+
+
+def transactions():
+    rng = random.Random(1)
+    return (json.dumps([transaction(rng, i, 1000) for i in range(ROWS)]).encode('utf-8'),
+            transform.compile_transform(tap_awin.TRANSACTION_STEPS,
+                                        dict(STAMPS, datasettype='advertiser'),
+                                        explode='transactionParts'))
+
+
+def reports():
+    rng = random.Random(1)
+    return (json.dumps([reportrow(rng, 1000, i) for i in range(ROWS)]).encode('utf-8'),
+            transform.compile_transform([], STAMPS))
+
+
+def pipeline(stream, body, reshape):
+    records = []
+    start = time.perf_counter()
+    for row in iter_json_array(CachedResponse(body)):
+        for record in reshape(row):
+            encode(singer.RecordMessage(stream=stream, record=record))
+            records.append(dict(record))
+    return time.perf_counter() - start, records
+
+
+def validation(validate, records):
+    start = time.perf_counter()
+    rejected = sum(1 for record in records if validate(record))
+    return time.perf_counter() - start, rejected
+
+
+def measure(stream, schema, body, reshape, repeat=3):
+    # Best of `repeat` runs of each, the copies of the records kept by
+    # pipeline are a small part of its time.
+    elapsed, records = min(pipeline(stream, body, reshape) for _ in range(repeat))
+    validated, rejected = min(validation(compile_validator(schema), records)
+                              for _ in range(repeat))
+    print('%-14s %8d records %8.2fus/record parse+reshape+encode %6.2fus/record validate '
+          '(%4.1f%%) %d rejected' % (stream, len(records), elapsed / len(records) * 1e6,
+                                      validated / len(records) * 1e6,
+                                      100.0 * validated / elapsed, rejected))
+
+
+def main():
+    measure('Transactions', tap_awin.TRANSACTION_SCHEMA, *transactions())
+    measure('AggReport', tap_awin.REPORT_SCHEMA, *reports())
+
+
+if __name__ == '__main__':
+    main()
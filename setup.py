@@ -14,9 +14,14 @@ setup(name='tap_awin',
           'pyrfc3339==1.0',
           'requests==2.14.0'
       ],
+      extras_require={
+          'fast': ['orjson'],
+          'columnar': ['pyarrow']
+      },
       entry_points='''
           [console_scripts]
           tap-awin=tap_awin:main
+          tap-awin-merge-state=tap_awin.shard:main
       ''',
       packages=['tap_awin'],
       include_package_data=True,
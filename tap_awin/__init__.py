@@ -1,32 +1,55 @@
 #!/usr/bin/env python3
 
+import os
 import sys
+import json
 import time
+import signal
 import argparse
-from datetime import timedelta
-import requests
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from collections import Counter
 import singer
 from singer import utils
 from pyrfc3339 import parse
+import requests
+from tap_awin.client import Client, API_URL, ordered_map, iter_json_array
+from tap_awin.scheduler import run_graph
+from tap_awin.writer import SingerWriter, SchemaGate
+from tap_awin.validate import RejectFile
+from tap_awin.cache import ResponseCache, CachedResponse
+from tap_awin.archive import Archive, Recorder
+from tap_awin.changeindex import ChangeIndex
+from tap_awin.metrics import Metrics
+from tap_awin.shard import parseshard, owns
+from tap_awin.columnar import ColumnarSink
+from tap_awin import transform
 
-PARSER = argparse.ArgumentParser()
-PARSER.add_argument('--config', action='store', dest='path',
-                    help='Path for configuration file')
-PARSER.add_argument('--state', action='store', dest='state',
-                    help='Path for state file')
-ARGUMENTS = PARSER.parse_args()
 LOGGER = singer.logger.get_logger()
 
-if ARGUMENTS.path is None:
-    LOGGER.error('Specify configuration file folder.')
-    sys.exit(1)
-PATH = ARGUMENTS.path
-AUTH = utils.load_json(PATH)
-AUTH['increment'] = int(AUTH['increment'])
-if ARGUMENTS.state:
-    STATE = utils.load_json(ARGUMENTS.state)
-else:
-    STATE = {}
+# Set by configure() when the tap runs, importing the module does not read
+# argv or the config file.
+ARGUMENTS = None
+AUTH = {}
+STATE = {}
+SELECTED = set()
+SHARD = None
+MAX_WORKERS = 1
+MAX_STREAMS = 1
+MAX_WINDOWS = 1
+METRICS = Metrics(LOGGER)
+CLIENT = None
+SPLIT_LATENCY = 60.0
+SPLIT_RECORDS = 100000
+CACHE_TTL = {}
+CACHE = None
+CHANGE_INDEX = None
+ARCHIVE = None
+REPLAY = False
+SINK = None
+WRITER = None
+REPORT_GATE = None
 
 ACCOUNT_SCHEMA = {"type":"object",
                   "properties":
@@ -41,13 +64,13 @@ ACCOUNT_SCHEMA = {"type":"object",
 PROGRAMMES_SCHEMA = {"type":"object",
                      "properties":
                          {"id":{"type":["number"]}, \
-                         "name":{"type":["mull", "string"]},\
-                         "displayUrl":{"type":["mull", "string"]},\
-                         "clickThroughUrl":{"type":["mull", "string"]},\
-                         "logoUrl":{"type":["mull", "string"]},\
-                         "countryName":{"type":["mull", "string"]},\
-                         "countryCode":{"type":["mull", "string"]},\
-                         "currencyCode":{"type":["mull", "string"]},\
+                         "name":{"type":["null", "string"]},\
+                         "displayUrl":{"type":["null", "string"]},\
+                         "clickThroughUrl":{"type":["null", "string"]},\
+                         "logoUrl":{"type":["null", "string"]},\
+                         "countryName":{"type":["null", "string"]},\
+                         "countryCode":{"type":["null", "string"]},\
+                         "currencyCode":{"type":["null", "string"]},\
                          "startDate": {"type":["string"]},\
                          "endDate": {"type":["string"]}\
                          }\
@@ -140,14 +163,14 @@ REPORT_SCHEMA = {"type": "object",
 PROGRAMMES_DETAILS = {"type":"object",
                       "properties":{\
                               "id":{"type":["number"]},\
-                              "name":{"type":["string"]},\
-                              "displayUrl":{"type":["string"]},\
-                              "clickThroughUrl":{"type":["string"]},\
-                              "logoUrl": {"type":["string"]},\
+                              "name":{"type":["null","string"]},\
+                              "displayUrl":{"type":["null","string"]},\
+                              "clickThroughUrl":{"type":["null","string"]},\
+                              "logoUrl": {"type":["null","string"]},\
                               "countryname": {"type":["string"]},\
                               "countrycode" : {"type":["string"]},\
                               "validDomains": {"type":["string"]},\
-                              "currencyCode": {"type":["string"]},\
+                              "currencyCode": {"type":["null","string"]},\
                               "averagePaymentTime": {"type":["string"]},\
                               "approvalPercentage": {"type":["number"]},\
                               "epc": {"type":["number"]},\
@@ -203,311 +226,793 @@ COMMISSIONGROUP_SCHEMA = {"type":"object",
                                           "groupId": {"type":["number"]},\
                                           "groupCode": {"type":["string"]},\
                                           "groupName": {"type":["string"]},\
-                                          "type": {"type":["string"]},\
+                                          "type": {"type":["null","string"]},\
                                           "percentage": {"type":["number"]},\
                                           "startDate": {"type":["string"]},\
                                           "endDate": {"type":["string"]}\
                                         }
                          }
+PROGRAMMES_STEPS = [transform.region('primaryRegion')]
+PROGRAMMES_DETAILS_STEPS = [transform.merge('kpi'),
+                            transform.merge('programmeInfo'),
+                            transform.region('primaryRegion'),
+                            transform.join('validDomains', 'domain'),
+                            transform.commissionrange('commissionRange', 'amount',
+                                                      'amountmin', 'amountmax'),
+                            transform.commissionrange('commissionRange', 'percentage',
+                                                      'percentagemin', 'percentagemax')]
+TRANSACTION_STEPS = [transform.amount('commissionAmount', 'commissionCurrency'),
+                     transform.amount('saleAmount', 'saleCurrency'),
+                     transform.merge('clickRefs'),
+                     transform.keyvalue('customParameters')]
+
 PUBLISHERS = []
 ADVERTISERS = []
-def getaccount():
-    accounts = requests.get('https://api.awin.com/accounts?accessToken=' + AUTH['accessToken'],
-                            headers={"user_agent":AUTH['user_agent']})
+STATE_LOCK = threading.Lock()
+# (date format, smallest step, smallest sub-range) of the date params
+TRANSACTION_RANGE = ('%Y-%m-%dT%H:%M:%S', timedelta(seconds=1), timedelta(hours=1))
+REPORT_RANGE = ('%Y-%m-%d', timedelta(days=1), timedelta(days=1))
+SPLIT_STATUSES = (400, 408, 413, 500, 502, 503, 504)
+SPANS = {}
+# Finished pairs per STATE message, a rerun repeats at most this many
+PAIR_BOOKMARKS = 100
+def stamps(window, **extra):
+    return dict(extra, startDate=window['startDate'], endDate=window['endDate'])
+
+def bookmarked(window, stream, key):
+    return key in window['bookmarks'].get(stream, ())
+
+def bookmark(window, stream, key, every=1):
+    # Remembers a finished account of an unfinished window and writes STATE
+    # so a rerun of the window only syncs the accounts still missing. The
+    # open window of a daemon is synced in full on every cycle. Streams of
+    # many small units (publisher/advertiser pairs) write STATE only every
+    # `every` bookmarks and call savebookmarks once they are done. Columnar
+    # rows of the stream written so far belong to finished accounts, their
+    # files are published before the STATE message that skips them.
+    if window.get('open'):
+        return
+    with STATE_LOCK:
+        if SINK is not None:
+            SINK.close(window['last_fetched'], stream)
+        window['bookmarks'].setdefault(stream, set()).add(key)
+        window['unsaved'] = window.get('unsaved', 0) + 1
+        if window['unsaved'] >= every:
+            writebookmarks(window)
+
+def savebookmarks(window):
+    with STATE_LOCK:
+        if window.get('unsaved'):
+            writebookmarks(window)
+
+def writebookmarks(window):
+    # Called with STATE_LOCK held.
+    window['unsaved'] = 0
+    STATE.setdefault('bookmarks', {})[window['last_fetched']] = \
+        dict((stream, sorted(keys)) for stream, keys in window['bookmarks'].items())
+    WRITER.write_state(STATE)
+
+def fail(window, message, stream=None):
+    # Columnar rows of stream written since its last bookmark belong to the
+    # failed account, which the next run syncs again.
+    LOGGER.error(message)
+    window['failed'] = True
+    if SINK is not None and stream is not None:
+        SINK.discard(window['last_fetched'], stream)
+
+def errorresponse(message, status_code):
+    return CachedResponse(json.dumps({'error':message}).encode('utf-8'), status_code)
+
+def notarchived(path):
+    return errorresponse('Not in archive: ' + path, 404)
+
+def cachedget(window, stream, path, params, account=None):
+    # Reference endpoints go through the disk cache when one is configured,
+    # changed is False when the body matches the one synced last time. They
+    # are not date filtered, so a replay may use the body of another window.
+    if REPLAY:
+        digests = ARCHIVE.replay(window['last_fetched'], path, params, anywindow=True)
+        return (CachedResponse(ARCHIVE.read(digests[-1])) if digests else notarchived(path)), True
+    fetch = partial(CLIENT.get, path, params=params, tags={'stream':stream, 'account':account})
+    if CACHE is None:
+        response, changed = fetch(), True
+    else:
+        response, changed = CACHE.get(path, params, CACHE_TTL[stream], fetch)
+    if ARCHIVE is not None and response.status_code == 200:
+        ARCHIVE.record(window['last_fetched'], path, params, response.content)
+    return response, changed
+
+def emitted(path, params, response):
+    # The records of a cachedget response were written, the same body is
+    # reported unchanged from now on.
+    if CACHE is not None:
+        CACHE.emitted(path, params, response.content)
+
+def getaccount(window):
+    params = {'accessToken':AUTH['accessToken']}
+    accounts, changed = cachedget(window, 'Accounts', '/accounts', params)
     if accounts.status_code == 200:
-        singer.write_schema("Accounts", ACCOUNT_SCHEMA, ["accountId"])
+        # Every shard needs all account ids, the records are only written
+        # by the first shard and when Accounts itself is selected.
+        emit = changed and 'Accounts' in SELECTED and (SHARD is None or SHARD[0] == 0)
+        if emit:
+            WRITER.write_schema("Accounts", ACCOUNT_SCHEMA, ["accountId"])
+        windowstamps = stamps(window)
+        advertisers = []
+        publishers = []
         for account in accounts.json()['accounts']:
             if account['accountType'] == 'advertiser':
-                ADVERTISERS.append(account['accountId'])
+                advertisers.append(account['accountId'])
             if account['accountType'] == 'publisher':
-                PUBLISHERS.append(account['publisher'])
-            account["startDate"] = str(parse(STATE['last_fetched']) + timedelta(days=1))
-            account["endDate"] = str(parse(STATE['last_fetched']) + \
-                                           timedelta(days=AUTH['increment']))
-            singer.write_record("Accounts", account)
+                publishers.append(account['accountId'])
+            if emit:
+                account.update(windowstamps)
+                WRITER.write_record("Accounts", account)
+        if emit:
+            emitted('/accounts', params, accounts)
+        ADVERTISERS[:] = advertisers
+        PUBLISHERS[:] = publishers
     else:
         LOGGER.error(accounts.json()['error'])
-        sys.exit(1)
+        # A daemon keeps the accounts it discovered before.
+        if not (ADVERTISERS or PUBLISHERS):
+            sys.exit(1)
 
-def getprogrammes():
+def getprogrammes(window):
+    reshape = transform.compile_transform(PROGRAMMES_STEPS, stamps(window))
     for publisher in PUBLISHERS:
-        programmes = requests.get('https://api.awin.com/publishers/' + str(publisher)+\
-                                  '/programmes?accessToken=' + AUTH['accessToken'],\
-                                  params=STATE['programmes'],
-                                  headers={"User-Agent":AUTH['user_agent']})
+        if not owns(SHARD, 'publisher/' + str(publisher)):
+            continue
+        path = '/publishers/' + str(publisher) + '/programmes'
+        programmes, changed = cachedget(window, 'Programmes', path, window['programmes'],
+                                        'publisher/' + str(publisher))
+        if not changed:
+            continue
         if programmes.status_code == 200:
-            singer.write_schema("Programmes", PROGRAMMES_SCHEMA, ["id"])
+            WRITER.write_schema("Programmes", PROGRAMMES_SCHEMA, ["id"])
             for program in programmes.json():
-                if 'primaryRegion' in program and program['primaryRegion'] != None:
-                    program['countryName'] = program['primaryRegion']['name']
-                    program["countryCode"] = program['primaryRegion']['countryCode']
-                    program.pop('primaryRegion')
-                program["startDate"] = str(parse(STATE['last_fetched']) + timedelta(days=1))
-                program["endDate"] = str(parse(STATE['last_fetched']) + \
-                                           timedelta(days=AUTH['increment']))
-                singer.write_record('Programmes', program)
+                for record in reshape(program):
+                    WRITER.write_record('Programmes', record)
+            emitted(path, window['programmes'], programmes)
         else:
             LOGGER.info('Error '+ str(programmes.content).replace('\n', ' ') +\
                         ' while retriving data for publisher ' + str(publisher))
-    time.sleep(10)
 
-def getprogrammesdetails():
-    singer.write_schema('ProgrammesDetails', PROGRAMMES_DETAILS, ['id'])
-    for publisher in PUBLISHERS:
-        for advertiser in ADVERTISERS:
-            progdetails = requests.get('https://api.awin.com/publishers/' + str(publisher) +\
-                                             '/programmedetails?advertiserId' +  str(advertiser),
-                                       headers={"User-Agent":AUTH['user_agent']})
-            if progdetails.status_code != 200:
-                LOGGER.info('Error ' + str(progdetails.content).replace('\n', ' ') + \
-                            ' in programmes details for Publisher:' + str(publisher) + \
-                            ' and avdertiser:' + str(advertiser))
-            else:
-                progdetails.update(progdetails['kpi'])
-                del progdetails['kpi']
-                progdetails.update(progdetails['programmeInfo'])
-                del progdetails['programmeInfo']
-                progdetails['countryCode'] = progdetails['primaryRegion']['countryCode']
-                progdetails['countryName'] = progdetails['primaryRegion']['name']
-                del progdetails['primaryRegion']
-                progdetails['validDomains'] = ','.join([domain['domain'] \
-                                                       for domain in progdetails['validDomains']])
-                progdetails['amountmin'], progdetails['amountmax'] = \
-                             [(i['max'], i['min']) for i in progdetails['commissionRange'] \
-                                                       if i['type'] == 'amount'][0]
-                progdetails['percentagemin'], progdetails['percentagemax'] = \
-                            [(i['max'], i['min']) for i in progdetails['commissionRange'] \
-                                                        if i['type'] == 'percentage'][0]
-                progdetails["startDate"] = str(parse(STATE['last_fetched']) + timedelta(days=1))
-                progdetails["endDate"] = str(parse(STATE['last_fetched']) + \
-                                               timedelta(days=AUTH['increment']))
-                singer.write_record('ProgrammesDetails', progdetails)
-    time.sleep(10)
-
-def transactiondataset(dataset, ttype):
-    if 'commissionAmount' in dataset:
-        commamount = dataset['commissionAmount']['amount']
-        dataset['commissionCurrency'] = dataset['commissionAmount']['currency']
-        dataset.pop('commissionAmount')
-        dataset['commissionAmount'] = commamount
-    if 'saleAmount' in dataset:
-        saleamount = dataset['saleAmount']['amount']
-        dataset['saleCurrency'] = dataset['saleAmount']['currency']
-        dataset.pop('saleAmount')
-        dataset['saleAmount'] = saleamount
-    if 'clickRefs' in dataset and dataset['clickRefs'] != None:
-        dataset.update(dataset.pop('clickRefs'))
-    dataset['datasettype'] = ttype
-    if 'customParameters' in dataset and dataset['customParameters'] != None:
-        dataset['customParameters'] = str(dict([(i['key'], i['value']) \
-                                               for i in dataset['customParameters']]))
-    if  'transactionParts' in dataset:
-        transactionparts = [parts for parts in dataset['transactionParts']]
-        dataset.pop('transactionParts')
-    dataset["startDate"] = str(parse(STATE['last_fetched']) + timedelta(days=1))
-    dataset["endDate"] = str(parse(STATE['last_fetched']) + timedelta(days=AUTH['increment']))
-    for data in transactionparts:
-        dataset.update(data)
-        singer.write_record('Transactions', dataset)
-
-def gettransactionlist():
-    singer.write_schema('Transactions', TRANSACTION_SCHEMA, ['id'])
-    for advertiser in ADVERTISERS:
-        transaction = requests.get('https://api.awin.com/advertisers/' + str(advertiser) +
-                                   '/transactions/', params=STATE['transactions'],
-                                   headers={"User-Agent":AUTH['user_agent']})
-        if transaction.status_code == 200:
-            for row in transaction.json():
-                transactiondataset(row, 'advertiser')
+def getrelationships(window):
+    # Advertisers each publisher has joined, without the Programmes filters.
+    # getpairs only requests these pairs, a publisher whose programmes could
+    # not be read keeps every advertiser.
+    params = {'relationship':'joined', 'accessToken':AUTH['accessToken']}
+    def fetch(publisher):
+        return (publisher,) + cachedget(window, 'Relationships',
+                                        '/publishers/' + str(publisher) + '/programmes',
+                                        params, 'publisher/' + str(publisher))
+    for publisher, programmes, _ in ordered_map(fetch, PUBLISHERS, MAX_WORKERS):
+        if programmes.status_code == 200:
+            window['relationships'][publisher] = set(program['id'] \
+                                                     for program in programmes.json())
         else:
-            LOGGER.error('Error ' + str(transaction.content).replace('\n', ' ') + \
-                         ' while retriving transaction list for avdertiser:' + str(advertiser))
-            sys.exit(1)
-
-    time.sleep(5)
-    for publisher in PUBLISHERS:
-        transaction = requests.get('https://api.awin.com/publishers/' + str(publisher) +
-                                   '/transactions/', params=STATE['transactions'],
-                                   headers={"User-Agent":AUTH['user_agent']})
-        if transaction.status_code == 200:
-            for row in transaction.json():
-                transactiondataset(row, 'publisher')
+            LOGGER.warning('Error ' + str(programmes.content).replace('\n', ' ') +
+                           ' while retriving joined programmes for publisher ' + str(publisher))
+
+def related(window, publisher, advertiser):
+    return publisher not in window['relationships'] or \
+           advertiser in window['relationships'][publisher]
+
+def pairrequest(pair, path):
+    return ('/publishers/' + str(pair[0]) + path,
+            {'advertiserId':pair[1], 'accessToken':AUTH['accessToken']})
+
+def getpairs(window, stream, path):
+    keys = [((publisher, advertiser), str(publisher) + '/' + str(advertiser)) \
+            for publisher in PUBLISHERS for advertiser in ADVERTISERS \
+            if related(window, publisher, advertiser)]
+    pairs = [pair for pair, key in keys if owns(SHARD, key) and not bookmarked(window, stream, key)]
+    def fetch(pair):
+        return (pair,) + cachedget(window, stream, *pairrequest(pair, path),
+                                   account=str(pair[0]) + '/' + str(pair[1]))
+    return ordered_map(fetch, pairs, MAX_WORKERS)
+
+def getprogrammesdetails(window):
+    WRITER.write_schema('ProgrammesDetails', PROGRAMMES_DETAILS, ['id'])
+    reshape = transform.compile_transform(PROGRAMMES_DETAILS_STEPS, stamps(window))
+    for (publisher, advertiser), response, changed in getpairs(window, 'ProgrammesDetails',
+                                                               '/programmedetails'):
+        if not changed:
+            continue
+        if response.status_code != 200:
+            LOGGER.info('Error ' + str(response.content).replace('\n', ' ') + \
+                        ' in programmes details for Publisher:' + str(publisher) + \
+                        ' and avdertiser:' + str(advertiser))
         else:
-            LOGGER.error('Error ' + str(transaction.content).replace('\n', ' ') +
-                         ' while retriving transaction list for publisher:' + str(publisher))
-            sys.exit(1)
-    time.sleep(5)
-
-def getaggreport():
-    singer.write_schema("AggReport", REPORT_SCHEMA, ["advertiserId", "publisherId", "region"])
-    for advertiser in ADVERTISERS:
-        reportdataset = requests.get('https://api.awin.com/advertisers/' + str(advertiser) +
-                                     '/reports/publisher', params=STATE['aggregatedReport'],
-                                     headers={"User-Agent":AUTH['user_agent']})
-        if reportdataset.status_code == 200:
-            for data in reportdataset.json():
-                data["startDate"] = str(parse(STATE['last_fetched']) + timedelta(days=1))
-                data["endDate"] = str(parse(STATE['last_fetched']) + \
-                                               timedelta(days=AUTH['increment']))
-                singer.write_record("AggReport", data)
+            for record in reshape(response.json()):
+                WRITER.write_record('ProgrammesDetails', record)
+            emitted(*pairrequest((publisher, advertiser), '/programmedetails'),
+                    response=response)
+
+def syncranges(window, stream, account, path, params, daterange, process, split=None):
+    # Requests startDate..endDate of params in consecutive sub-ranges, halving
+    # the sub-range after a rejected, slow or very large response and
+    # doubling it after a quick small one. The span that worked is kept per
+    # account for the next window. Returns the failed response, if any.
+    # Responses of a sub-range go to split instead of process when given.
+    # A timeout is not retried but splits the sub-range, only the smallest
+    # one is retried. A timed out, broken or malformed response body fails
+    # the account.
+    # A replay processes the sub-ranges captured for the window instead.
+    if REPLAY:
+        digests = ARCHIVE.replay(window['last_fetched'], path, params)
+        if digests is None:
+            return notarchived(path)
+        handler = process if split is None or len(digests) == 1 else split
+        for digest in digests:
+            try:
+                count = handler(CachedResponse(ARCHIVE.read(digest)))
+            except ValueError as exc:
+                return errorresponse('Response failed: ' + str(exc), 502)
+            METRICS.rows(count, stream=stream, account=account)
+        return None
+    dateformat, step, minimum = daterange
+    start = first = datetime.strptime(params['startDate'], dateformat)
+    end = datetime.strptime(params['endDate'], dateformat)
+    whole = end - start + step
+    span = min(SPANS.get((stream, account), whole), whole)
+    ceiling = whole + step
+    while start <= end:
+        stop = min(start + span - step, end)
+        started = time.monotonic()
+        try:
+            response = CLIENT.get(path, params=dict(params, startDate=start.strftime(dateformat),
+                                                    endDate=stop.strftime(dateformat)),
+                                  stream=True, tags={'stream':stream, 'account':account},
+                                  retry_timeouts=span <= minimum)
+        except requests.Timeout as exc:
+            if span <= minimum:
+                return errorresponse('Timed out: ' + str(exc), 504)
+            ceiling, span = span, max(minimum, span // 2)
+            continue
+        if response.status_code != 200:
+            if response.status_code in SPLIT_STATUSES and span > minimum:
+                response.close()
+                ceiling, span = span, max(minimum, span // 2)
+                continue
+            return response
+        recorder = Recorder(response) if ARCHIVE is not None else None
+        try:
+            if split is None or (start == first and stop == end):
+                count = process(response)
+            else:
+                count = split(response)
+        except (requests.RequestException, ValueError) as exc:
+            # e.g. a read timeout while streaming or a malformed or truncated
+            # JSON array, rows already written are sent again by the rerun of
+            # the window.
+            return errorresponse('Response failed: ' + str(exc), 502)
+        finally:
+            # Frees the in flight slot of the client, also when process did
+            # not read the whole body.
+            response.close()
+        if recorder is not None:
+            ARCHIVE.record(window['last_fetched'], path, params, recorder)
+        METRICS.rows(count, stream=stream, account=account)
+        if time.monotonic() - started > SPLIT_LATENCY or count > SPLIT_RECORDS:
+            span = max(minimum, span // 2)
+        elif count < SPLIT_RECORDS // 4 and span * 2 < ceiling:
+            span = min(whole, span * 2)
+        # Only a split is remembered, a window that fit in one request does
+        # not limit a longer one (e.g. the growing open window of a daemon).
+        if span < whole:
+            SPANS[(stream, account)] = span
         else:
-            LOGGER.error('Error ' + str(reportdataset.content).replace('\n', ' ') +
-                         ' while retriving aggregate report for advertiser:' + str(advertiser))
-            sys.exit(1)
-    time.sleep(5)
-    for publisher in PUBLISHERS:
-        reportdataset = requests.get('https://api.awin.com/publishers/' + str(publisher) +
-                                     '/reports/advertiser', params=STATE['aggregatedReport'],
-                                     headers={"User-Agent":AUTH['user_agent']})
-        if reportdataset.status_code == 200:
-            for data in reportdataset.json():
-                data["startDate"] = str(parse(STATE['last_fetched']) + timedelta(days=1))
-                data["endDate"] = str(parse(STATE['last_fetched']) + \
-                                               timedelta(days=AUTH['increment']))
-                singer.write_record("AggReport", data)
+            SPANS.pop((stream, account), None)
+        start = stop + step
+    return None
+
+def writerecord(window, name, record):
+    # Records of the columnar streams also (or only) go to the sink. name is
+    # the catalog entry, the creative report is written as AggReport. The
+    # open window is synced again until it has ended, only then are its
+    # rows written to files.
+    stream, schema, _ = CATALOG[name]
+    if SINK is None or name not in SINK.streams:
+        WRITER.write_record(stream, record)
+    elif WRITER.accept(stream, record):
+        if not window.get('open'):
+            SINK.write(name, schema, window['last_fetched'], record)
+        if not AUTH.get('columnar_only'):
+            WRITER.write_message(singer.RecordMessage(stream=stream, record=record))
+
+def writetransactions(window, reshape, response):
+    count = 0
+    for row in iter_json_array(response):
+        for record in reshape(row):
+            count += 1
+            if CHANGE_INDEX is None or CHANGE_INDEX.changed(window['last_fetched'], record):
+                writerecord(window, 'Transactions', record)
+    return count
+
+def summablefields(schema):
+    return set(name for name, spec in schema['properties'].items() \
+               if 'number' in spec['type'] and not name.endswith('Id'))
+
+def writereport(window, stream, windowstamps, response):
+    count = 0
+    with REPORT_GATE.hold(CATALOG[stream][1]):
+        for data in iter_json_array(response):
+            count += 1
+            data.update(windowstamps)
+            writerecord(window, stream, data)
+    return count
+
+def mergereport(rows, summable, response):
+    # Rows of several sub-ranges are summed into one row per report key.
+    count = 0
+    for data in iter_json_array(response):
+        count += 1
+        key = tuple(sorted((k, v) for k, v in data.items() if k not in summable))
+        if key in rows:
+            for field in summable:
+                if data.get(field) is not None:
+                    rows[key][field] = (rows[key].get(field) or 0) + data[field]
         else:
-            LOGGER.error('Error ' + str(reportdataset.content).replace('\n', ' ') +
-                         ' while retriving aggregate report for publisher:' + str(publisher))
-            sys.exit(1)
-    time.sleep(5)
-
-def getaggreportcreative():
-    singer.write_schema("AggReport", AGGREGATED_CREATIVE_SCHEMA, ["advertiserId", "publisherId",
-                                                                  "region"])
-    for advertiser in ADVERTISERS:
-        reportdataset = requests.get('https://api.awin.com/advertisers/'+str(advertiser) +
-                                     '/reports/creative', params=STATE['aggregatedByCreative'],
-                                     headers={"User-Agent":AUTH['user_agent']})
-        if reportdataset.status_code == 200:
-            for data in reportdataset.json():
-                data["startDate"] = str(parse(STATE['last_fetched']) + timedelta(days=1))
-                data["endDate"] = str(parse(STATE['last_fetched']) + \
-                                               timedelta(days=AUTH['increment']))
-                singer.write_record("AggReport", data)
+            rows[key] = data
+    return count
+
+def gettransactionlist(window):
+    WRITER.write_schema('Transactions', TRANSACTION_SCHEMA, ['id'])
+    for ttype, accounts in [('advertiser', ADVERTISERS), ('publisher', PUBLISHERS)]:
+        reshape = transform.compile_transform(TRANSACTION_STEPS,
+                                              stamps(window, datasettype=ttype),
+                                              explode='transactionParts')
+        for account in accounts:
+            key = ttype + '/' + str(account)
+            if not owns(SHARD, key) or bookmarked(window, 'Transactions', key):
+                continue
+            transaction = syncranges(window, 'Transactions', key,
+                                     '/' + ttype + 's/' + str(account) + '/transactions/',
+                                     window['transactions'], TRANSACTION_RANGE,
+                                     partial(writetransactions, window, reshape))
+            if transaction is None:
+                bookmark(window, 'Transactions', key)
+            else:
+                fail(window, 'Error ' + str(transaction.content).replace('\n', ' ') + \
+                             ' while retriving transaction list for ' + ttype + ':' + \
+                             str(account), 'Transactions')
+
+def getreport(window, stream, schema, params, paths):
+    # Both reports emit the AggReport stream with different schemas, records
+    # are only written while REPORT_GATE is held for their schema.
+    windowstamps = stamps(window)
+    summable = summablefields(schema)
+    for ttype, accounts in [('advertiser', ADVERTISERS), ('publisher', PUBLISHERS)]:
+        for account in accounts:
+            key = ttype + '/' + str(account)
+            if not owns(SHARD, key) or bookmarked(window, stream, key):
+                continue
+            # A window requested in one piece is streamed, rows of
+            # sub-ranges are merged and written once all are in.
+            rows = {}
+            reportdataset = syncranges(window, stream, key,
+                                       '/' + ttype + 's/' + str(account) + paths[ttype],
+                                       window[params], REPORT_RANGE,
+                                       partial(writereport, window, stream, windowstamps),
+                                       partial(mergereport, rows, summable))
+            if reportdataset is None:
+                with REPORT_GATE.hold(schema):
+                    for data in rows.values():
+                        data.update(windowstamps)
+                        writerecord(window, stream, data)
+                bookmark(window, stream, key)
+            else:
+                fail(window, 'Error ' + str(reportdataset.content).replace('\n', ' ') +
+                     ' while retriving ' + stream + ' for ' + ttype + ':' + str(account),
+                     stream)
+
+def getaggreport(window):
+    getreport(window, 'AggReport', REPORT_SCHEMA, 'aggregatedReport',
+              {'advertiser':'/reports/publisher', 'publisher':'/reports/advertiser'})
+
+def getaggreportcreative(window):
+    getreport(window, 'AggReportCreative', AGGREGATED_CREATIVE_SCHEMA, 'aggregatedByCreative',
+              {'advertiser':'/reports/creative', 'publisher':'/reports/creative'})
+
+def getcommissiongroups(window):
+    WRITER.write_schema('Commissiongroup', COMMISSIONGROUP_SCHEMA, ['groupId'])
+    windowstamps = stamps(window)
+    for (publisher, advertiser), commissiongroups, changed in getpairs(window, 'Commissiongroup',
+                                                                       '/commissiongroups'):
+        if not changed:
+            continue
+        if commissiongroups.status_code == 200:
+            for commission in commissiongroups.json():
+                commission.update(windowstamps)
+                WRITER.write_record('Commissiongroup', commission)
+            emitted(*pairrequest((publisher, advertiser), '/commissiongroups'),
+                    response=commissiongroups)
+            bookmark(window, 'Commissiongroup', str(publisher) + '/' + str(advertiser),
+                     every=PAIR_BOOKMARKS)
         else:
-            LOGGER.error("Error" + str(reportdataset.content).replace('\n', ' ') +
-                         " while extracting data in report creative for advertiser: " +
-                         str(advertiser))
+            fail(window, "Error" + str(commissiongroups.content).replace('\n', ' ') +
+                 " while extracting data for commission group for publisher: " +
+                 str(publisher) + " and advertiser: " + str(advertiser))
+    savebookmarks(window)
+
+# Accounts fills ADVERTISERS/PUBLISHERS for every other stream, Relationships
+# (not a stream of its own) the pairs ProgrammesDetails and Commissiongroup
+# request. The creative report reuses the AggReport stream name with its own
+# schema, REPORT_GATE keeps the records of the two reports apart.
+STREAMS = [('Accounts', getaccount, []),
+           ('Programmes', getprogrammes, ['Accounts']),
+           ('Relationships', getrelationships, ['Accounts']),
+           ('ProgrammesDetails', getprogrammesdetails, ['Relationships']),
+           ('Transactions', gettransactionlist, ['Accounts']),
+           ('AggReport', getaggreport, ['Accounts']),
+           ('AggReportCreative', getaggreportcreative, ['Accounts']),
+           ('Commissiongroup', getcommissiongroups, ['Relationships'])]
+WINDOWED_STREAMS = ['Transactions', 'AggReport', 'AggReportCreative']
+# Catalog entries: stream name, schema and key properties of every task
+CATALOG = {'Accounts': ('Accounts', ACCOUNT_SCHEMA, ['accountId']),
+           'Programmes': ('Programmes', PROGRAMMES_SCHEMA, ['id']),
+           'ProgrammesDetails': ('ProgrammesDetails', PROGRAMMES_DETAILS, ['id']),
+           'Transactions': ('Transactions', TRANSACTION_SCHEMA, ['id']),
+           'AggReport': ('AggReport', REPORT_SCHEMA,
+                         ['advertiserId', 'publisherId', 'region']),
+           'AggReportCreative': ('AggReport', AGGREGATED_CREATIVE_SCHEMA,
+                                 ['advertiserId', 'publisherId', 'region']),
+           'Commissiongroup': ('Commissiongroup', COMMISSIONGROUP_SCHEMA, ['groupId'])}
+
+def timed(name, func, window):
+    started = time.monotonic()
+    try:
+        func(window)
+    finally:
+        METRICS.job(time.monotonic() - started, stream=name)
+
+def getreports(window, names):
+    run_graph([(name, partial(timed, name, func, window), [dep for dep in deps if dep in names]) \
+               for name, func, deps in STREAMS if name in names], MAX_STREAMS)
+
+def initstate():
+    STATE['transactions'] = {'dateType':AUTH['dateType']}
+    STATE['transactions']['timezone'] = AUTH['timezone']
+    STATE['transactions']['status'] = AUTH['status']
+
+    STATE['aggregatedByCreative'] = {'dateType':AUTH['dateType']}
+    STATE['aggregatedByCreative']['timezone'] = AUTH['timezone']
+    STATE['aggregatedByCreative']['region'] = AUTH['region']
+
+    STATE['aggregatedReport'] = {'dateType':AUTH['dateType']}
+    STATE['aggregatedReport']['timezone'] = AUTH['timezone']
+    STATE['aggregatedReport']['region'] = AUTH['region']
+
+    STATE['programmes'] = {'relationship':AUTH['relationship']}
+    STATE['programmes']['countryCode'] = AUTH['countryCode']
+
+def getwindows(date, enddate=None):
+    # Consecutive `increment`-day windows from date until enddate (a single
+    # window without one), each window carrying its own request params and
+    # the startDate/endDate stamps a standalone run for it would produce.
+    windows = []
+    stampbase = STATE.get('last_fetched')
+    while True:
+        end = date + timedelta(days=AUTH['increment']) + timedelta(seconds=-1)
+        window = {'last_fetched':str(end.isoformat())}
+        window['bookmarks'] = dict((stream, set(keys)) for stream, keys in \
+                                   STATE.get('bookmarks', {}).get(window['last_fetched'], {})\
+                                   .items())
+        base = parse(stampbase) if stampbase else end
+        window['startDate'] = str(base + timedelta(days=1))
+        window['endDate'] = str(base + timedelta(days=AUTH['increment']))
+        window['transactions'] = dict(STATE['transactions'], accessToken=AUTH['accessToken'])
+        window['transactions']['startDate'] = str(date.isoformat())[0:19]
+        window['transactions']['endDate'] = str(end.isoformat())[0:19]
+        for report in ['aggregatedByCreative', 'aggregatedReport']:
+            window[report] = dict(STATE[report], accessToken=AUTH['accessToken'])
+            window[report]['startDate'] = str(date.isoformat())[0:10]
+            window[report]['endDate'] = str((date + timedelta(days=(AUTH['increment'] - 1)))\
+                                            .isoformat())[0:10]
+        window['programmes'] = dict(STATE['programmes'], accessToken=AUTH['accessToken'])
+        window['relationships'] = {}
+        windows.append(window)
+        stampbase = window['last_fetched']
+        date = end + timedelta(seconds=1)
+        if enddate is None or date > enddate:
+            return windows
+
+def openwindow(windows, now):
+    # The last window is open when it has not ended by now: its transactions
+    # are requested up to now and the state does not move past it, the next
+    # run (or daemon cycle) syncs it again.
+    last = windows[-1]
+    if parse(last['last_fetched']) > now:
+        last['open'] = True
+        end = now.astimezone(parse(last['last_fetched']).tzinfo)
+        last['transactions']['endDate'] = str(end.isoformat())[0:19]
+    return windows
+
+def checkpoint(window):
+    # The state of the open window of a daemon only moves on once the window
+    # has ended, its change index fingerprints are kept after every cycle.
+    # The unchanged state is written for it so the target still commits the
+    # rows sent. Fingerprints are only kept once the rows are on stdout.
+    # Columnar files of the window are complete before its STATE message.
+    if not window.get('open'):
+        if SINK is not None:
+            SINK.close(window['last_fetched'])
+        writecheckpoint(window)
+    else:
+        with STATE_LOCK:
+            WRITER.write_state(STATE)
+    if CHANGE_INDEX is not None:
+        WRITER.sync()
+        CHANGE_INDEX.checkpoint(window['last_fetched'])
+
+def writecheckpoint(window):
+    with STATE_LOCK:
+        for key in ['transactions', 'aggregatedByCreative', 'aggregatedReport']:
+            STATE[key] = dict((k, v) for k, v in window[key].items() if k != 'accessToken')
+        STATE['last_fetched'] = window['last_fetched']
+        STATE.get('bookmarks', {}).pop(window['last_fetched'], None)
+        if 'bookmarks' in STATE and not STATE['bookmarks']:
+            del STATE['bookmarks']
+        WRITER.write_state(STATE)
+
+def savestate(path):
+    with STATE_LOCK:
+        with open(path + '.tmp', 'w') as state:
+            json.dump(STATE, state)
+    os.replace(path + '.tmp', path)
+
+def parseargs(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', action='store', dest='path',
+                        help='Path for configuration file')
+    parser.add_argument('--state', action='store', dest='state',
+                        help='Path for state file')
+    parser.add_argument('--backfill', action='store_true',
+                        help='Sync every window from the state or start_date until end_date')
+    parser.add_argument('--end_date', action='store', dest='end_date',
+                        help='RFC3339 end of a --backfill, defaults to now')
+    parser.add_argument('--discover', action='store_true',
+                        help='Write the catalog of all streams to stdout')
+    parser.add_argument('--catalog', action='store', dest='catalog',
+                        help='Path for catalog file, only its selected streams are synced')
+    parser.add_argument('--shard', action='store', dest='shard',
+                        help='i/N, sync only the accounts of shard i (0 to N-1) of N')
+    parser.add_argument('--replay', action='store_true',
+                        help='Read the responses captured in archive_dir instead of the API')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running and sync every poll_interval seconds, '
+                             'the state is saved to the --state file after each cycle')
+    return parser.parse_args(argv)
+
+def discover():
+    streams = []
+    for name, _, _ in STREAMS:
+        if name not in CATALOG:
+            continue
+        stream, schema, keys = CATALOG[name]
+        streams.append({'tap_stream_id':name, 'stream':stream, 'schema':schema,
+                        'key_properties':keys,
+                        'metadata':[{'breadcrumb':[],
+                                     'metadata':{'table-key-properties':keys,
+                                                 'selected-by-default':True}}]})
+    json.dump({'streams':streams}, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+def selectedstreams(catalog):
+    selected = set()
+    for entry in catalog.get('streams', []):
+        metadata = dict((tuple(item['breadcrumb']), item['metadata']) \
+                        for item in entry.get('metadata', []))
+        if metadata.get((), {}).get('selected', entry.get('schema', {}).get('selected')):
+            selected.add(entry['tap_stream_id'])
+    unknown = selected - set(CATALOG)
+    if unknown:
+        LOGGER.warning('Unknown streams in catalog: ' + ', '.join(sorted(unknown)))
+    return selected & set(CATALOG)
+
+def configure(args):
+    global ARGUMENTS, AUTH, STATE, SELECTED, SHARD, MAX_WORKERS, MAX_STREAMS, MAX_WINDOWS, CLIENT, \
+           SPLIT_LATENCY, SPLIT_RECORDS, CACHE_TTL, CACHE, CHANGE_INDEX, ARCHIVE, REPLAY, SINK, \
+           WRITER, REPORT_GATE
+    if args.path is None:
+        LOGGER.error('Specify configuration file folder.')
+        sys.exit(1)
+    ARGUMENTS = args
+    AUTH = utils.load_json(args.path)
+    AUTH['increment'] = int(AUTH['increment'])
+    if args.daemon and not args.state:
+        LOGGER.error('--daemon needs a --state file to save its state to')
+        sys.exit(1)
+    STATE = utils.load_json(args.state) if args.state and \
+            (not args.daemon or os.path.exists(args.state)) else {}
+    SELECTED = selectedstreams(utils.load_json(args.catalog)) if args.catalog \
+               else set(CATALOG)
+    try:
+        SHARD = parseshard(args.shard) if args.shard else None
+    except ValueError as exc:
+        LOGGER.error(str(exc))
+        sys.exit(1)
+    # A shard's state only covers its own accounts, a fresh or merged state
+    # can start any shard.
+    shard = '%d/%d' % SHARD if SHARD else None
+    if 'shard' in STATE and STATE['shard'] != shard:
+        LOGGER.error('State belongs to shard ' + str(STATE.get('shard')) + ', not ' + str(shard) +
+                     ', merge shard states with tap-awin-merge-state')
+        sys.exit(1)
+    if shard:
+        STATE['shard'] = shard
+
+    MAX_WORKERS = int(AUTH.get('max_workers', 1))
+    MAX_STREAMS = int(AUTH.get('max_streams', 1))
+    MAX_WINDOWS = int(AUTH.get('max_windows', 1))
+    CLIENT = Client(AUTH['user_agent'], rate_limit=AUTH.get('rate_limit', 20),
+                    burst=AUTH.get('rate_limit_burst'), api_url=AUTH.get('api_url', API_URL),
+                    rate_limit_max=AUTH.get('rate_limit_max',
+                                            2 * float(AUTH.get('rate_limit', 20))),
+                    pool_size=max(10, MAX_WORKERS * MAX_STREAMS * MAX_WINDOWS),
+                    max_retries=int(AUTH.get('max_retries', 5)),
+                    backoff_base=float(AUTH.get('backoff_base', 1)),
+                    backoff_max=float(AUTH.get('backoff_max', 60)),
+                    latency_target=AUTH.get('latency_target'), metrics=METRICS)
+    SPLIT_LATENCY = float(AUTH.get('split_latency', 60))
+    SPLIT_RECORDS = int(AUTH.get('split_records', 100000))
+    CACHE_TTL = dict({'Accounts':86400, 'Programmes':86400, 'Relationships':86400,
+                      'ProgrammesDetails':86400, 'Commissiongroup':86400},
+                     **AUTH.get('cache_ttl', {}))
+    CACHE = ResponseCache(AUTH['cache_dir'], int(AUTH.get('cache_max_bytes', 104857600))) \
+            if AUTH.get('cache_dir') else None
+    CHANGE_INDEX = ChangeIndex(AUTH['change_index']) if AUTH.get('change_index') else None
+    ARCHIVE = Archive(AUTH['archive_dir']) if AUTH.get('archive_dir') else None
+    REPLAY = args.replay
+    if REPLAY:
+        if ARCHIVE is None:
+            LOGGER.error('--replay needs "archive_dir" in the config')
             sys.exit(1)
-    time.sleep(5)
-    for publisher in PUBLISHERS:
-        reportdataset = requests.get('https://api.awin.com/publishers/' + str(publisher) +
-                                     '/reports/creative', params=STATE['aggregatedByCreative'],
-                                     headers={"User-Agent":AUTH['user_agent']})
-        if reportdataset.status_code == 200:
-            for data in reportdataset.json():
-                data["startDate"] = str(parse(STATE['last_fetched']) + timedelta(days=1))
-                data["endDate"] = str(parse(STATE['last_fetched']) + \
-                                               timedelta(days=AUTH['increment']))
-                singer.write_record("AggReport", data)
+        # Reprocessing emits every archived record again.
+        CACHE = None
+        CHANGE_INDEX = None
+    try:
+        SINK = ColumnarSink(AUTH['columnar_dir'],
+                            AUTH.get('columnar_streams',
+                                     ['Transactions', 'AggReport', 'AggReportCreative']),
+                            AUTH.get('columnar_format'),
+                            int(AUTH.get('columnar_batch_rows', 50000))) \
+               if AUTH.get('columnar_dir') else None
+    except ValueError as exc:
+        LOGGER.error(str(exc))
+        sys.exit(1)
+    WRITER = SingerWriter(buffer_size=int(AUTH.get('write_buffer_size', 1048576)),
+                          validate=AUTH.get('validate', True),
+                          rejects=RejectFile(AUTH['reject_file']) \
+                                  if AUTH.get('reject_file') else None)
+    REPORT_GATE = SchemaGate(WRITER, 'AggReport', CATALOG['AggReport'][2])
+
+def main(argv=None):
+    args = parseargs(argv)
+    if args.discover:
+        discover()
+        return
+    configure(args)
+    WRITER.start()
+    reported = {'records':Counter(), 'rejected':Counter()}
+    try:
+        if args.daemon:
+            daemon(reported)
         else:
-            LOGGER.error("Error " + str(reportdataset.content).replace('\n', ' ') +
-                         " while extracting data in report creative for publisher: " +
-                         str(publisher))
-            sys.exit(1)
-    time.sleep(5)
+            sync()
+    finally:
+        if CACHE is not None:
+            CACHE.save()
+        if CHANGE_INDEX is not None:
+            CHANGE_INDEX.close()
+        if ARCHIVE is not None:
+            ARCHIVE.save()
+        if SINK is not None:
+            SINK.discard()
+        try:
+            WRITER.close()
+        finally:
+            reportmetrics(reported)
+            if WRITER.rejects is not None:
+                WRITER.rejects.close()
+
+def reportmetrics(reported):
+    # Reports the records written and rejected since the last call.
+    for name in ['records', 'rejected']:
+        counts = dict(getattr(WRITER, name))
+        for stream, count in sorted((Counter(counts) - reported[name]).items()):
+            getattr(METRICS, name)(count, stream=stream)
+        reported[name] = Counter(counts)
+    if AUTH.get('prometheus_textfile'):
+        METRICS.write_textfile(AUTH['prometheus_textfile'])
+
+def startdate():
+    if 'transactions' not in STATE:
+        initstate()
+    if 'last_fetched' in STATE:
+        return parse(STATE['last_fetched']) + timedelta(seconds=1)
+    try:
+        return parse(AUTH['start_date'])
+    except ValueError:
+        LOGGER.error('start_date should be in RFC3339 format')
+        sys.exit(1)
 
-def getcommissiongroups():
-    singer.write_schema('Commissiongroup', COMMISSIONGROUP_SCHEMA, ['groupId'])
-    for publisher in PUBLISHERS:
-        for advertiser in ADVERTISERS:
-            commissiongroups = requests.get('https://api.awin.com/publishers/' + publisher +
-                                            '/commissiongroups?advertiserId=' + advertiser,
-                                            params=AUTH['accessToken'],
-                                            headers={"User-Agent":AUTH['user_agent']})
-            if commissiongroups.status_code == 200:
-                for commission in commissiongroups.json():
-                    commission["startDate"] = str(parse(STATE['last_fetched']) + timedelta(days=1))
-                    commission["endDate"] = (parse(STATE['last_fetched']) + \
-                                               timedelta(days=AUTH['increment']))
-                    singer.write_record('Commissiongroup', commission)
-            else:
-                LOGGER.error("Error" + str(commissiongroups.content).replace('\n', ' ') +
-                             " while extracting data for commission group for publisher: " +
-                             str(publisher) + " and advertiser: " + str(advertiser))
-                sys.exit(1)
-
-def getreports():
-    getaccount()
-    getprogrammes()
-    getprogrammesdetails()
-    gettransactionlist()
-    getaggreport()
-    getaggreportcreative()
-    getcommissiongroups()
-
-def main():
-    if not any(STATE):
+def sync():
+    DATE = startdate()
+    now = datetime.now(timezone.utc)
+    if ARGUMENTS.backfill:
         try:
-            DATE = parse(AUTH['start_date'])
+            enddate = min(parse(ARGUMENTS.end_date), now) if ARGUMENTS.end_date else now
         except ValueError:
-            LOGGER.error('start_date should be in RFC3339 format')
+            LOGGER.error('end_date should be in RFC3339 format')
             sys.exit(1)
-        STATE['transactions'] = {'dateType':AUTH['dateType']}
-        STATE['transactions']['timezone'] = AUTH['timezone']
-        STATE['transactions']['status'] = AUTH['status']
-        STATE['transactions']['startDate'] = str(DATE.isoformat())[0:19]
-        STATE['transactions']['endDate'] = str((DATE + timedelta(days=AUTH['increment'])\
-                                                     + timedelta(seconds=-1))\
-                                                                 .isoformat())[0:19]
-        STATE['transactions']['accessToken'] = AUTH['accessToken']
-
-        STATE['aggregatedByCreative'] = {'dateType':AUTH['dateType']}
-        STATE['aggregatedByCreative']['timezone'] = AUTH['timezone']
-        STATE['aggregatedByCreative']['region'] = AUTH['region']
-        STATE['aggregatedByCreative']['startDate'] = str(DATE.isoformat())[0:10]
-        STATE['aggregatedByCreative']['endDate'] = str((DATE + \
-                                                        timedelta(days=(AUTH['increment']-1)))\
-                                                        .isoformat())[0:10]
-        STATE['aggregatedByCreative']['accessToken'] = AUTH['accessToken']
-
-        STATE['aggregatedReport'] = {'dateType':AUTH['dateType']}
-        STATE['aggregatedReport']['timezone'] = AUTH['timezone']
-        STATE['aggregatedReport']['region'] = AUTH['region']
-        STATE['aggregatedReport']['startDate'] = str(DATE.isoformat())[0:10]
-        STATE['aggregatedReport']['endDate'] = str((DATE + timedelta(days=(AUTH['increment']-1)))\
-                                                   .isoformat())[0:10]
-        STATE['aggregatedReport']['accessToken'] = AUTH['accessToken']
-
-        STATE['programmes'] = {'relationship':AUTH['relationship']}
-        STATE['programmes']['countryCode'] = AUTH['countryCode']
-        STATE['programmes']['accessToken'] = AUTH['accessToken']
-
-        STATE['last_fetched'] = str((DATE + timedelta(days=AUTH['increment'])\
-                                                     + timedelta(seconds=-1))\
-                                                                 .isoformat())
-
+        windows = openwindow(getwindows(DATE, enddate), now)
     else:
-        DATE = parse(STATE['last_fetched']) + timedelta(seconds=1)
-        STATE['transactions']['startDate'] = str(DATE.isoformat())[0:19]
-        STATE['transactions']['endDate'] = str((DATE + timedelta(days=AUTH['increment'])\
-                                                     + timedelta(seconds=-1))\
-                                              .isoformat())[0:19]
-        STATE['transactions']['accessToken'] = AUTH['accessToken']
-
-        STATE['aggregatedByCreative']['startDate'] = str(DATE.isoformat())[0:10]
-        STATE['aggregatedByCreative']['endDate'] = str((DATE +
-                                                        timedelta(days=(AUTH['increment'] -1)))\
-                                                        .isoformat())[0:10]
-        STATE['aggregatedByCreative']['accessToken'] = AUTH['accessToken']
-
-        STATE['aggregatedReport']['startDate'] = str(DATE.isoformat())[0:10]
-        STATE['aggregatedReport']['endDate'] = str((DATE + timedelta(days=(AUTH['increment'] - 1)))\
-                                                        .isoformat())[0:10]
-        STATE['aggregatedReport']['accessToken'] = AUTH['accessToken']
-
-        STATE['programmes']['accessToken'] = AUTH['accessToken']
-
-    getreports()
-    STATE['last_fetched'] = str((DATE + timedelta(days=AUTH['increment'])\
-                                                     + timedelta(seconds=-1))\
-                                              .isoformat())
-    del STATE['transactions']['accessToken']
-    del STATE['aggregatedByCreative']['accessToken']
-    del STATE['aggregatedReport']['accessToken']
-    del STATE['programmes']['accessToken']
-
-    singer.write_state(STATE)
+        windows = openwindow(getwindows(DATE), now)
+    if windows[-1].get('open'):
+        LOGGER.info('Window ending ' + windows[-1]['last_fetched'] + ' has not ended, it is '
+                    'synced up to now and the state stays before it')
+    if not syncwindows(windows):
+        sys.exit(1)
+
+def syncwindows(windows, reference=True):
+    # Reference streams are not date filtered, so a backfill syncs them once
+    # with the first window and only repeats the windowed streams. Nothing is
+    # requested for unselected streams, Accounts is only skipped when no
+    # stream is selected at all. Returns False when a window failed.
+    if SELECTED and reference:
+        getreports(windows[0], ['Accounts'])
+    tasks = set(SELECTED)
+    if AUTH.get('prune_pairs', True) and tasks & set(['ProgrammesDetails', 'Commissiongroup']):
+        tasks.add('Relationships')
+    names = [name for name, _, _ in STREAMS if name != 'Accounts' and name in tasks]
+    windowed = [name for name in WINDOWED_STREAMS if name in SELECTED]
+    def syncwindow(window):
+        getreports(window, names if reference and window is windows[0] else windowed)
+        return window
+    for window in ordered_map(syncwindow, windows, MAX_WINDOWS):
+        if window.get('failed'):
+            # Accounts finished so far are bookmarked, a rerun resumes here.
+            LOGGER.error('Window ending ' + window['last_fetched'] + ' did not complete')
+            return False
+        checkpoint(window)
+    return True
+
+def daemon(reported):
+    # Syncs every window that started before now each poll_interval seconds,
+    # reusing the connection pool, account list and sub-range spans. Accounts
+    # and the reference streams are refreshed every accounts_interval
+    # seconds. The window still in progress (open) is synced up to now on
+    # every cycle without moving the state past it. SIGTERM or SIGINT stop
+    # the daemon once the current cycle has finished.
+    interval = float(AUTH.get('poll_interval', 300))
+    refresh = float(AUTH.get('accounts_interval', 3600))
+    stop = threading.Event()
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(signum, lambda *_: stop.set())
+    refreshed = None
+    while not stop.is_set():
+        started = time.monotonic()
+        now = datetime.now(timezone.utc)
+        windows = openwindow(getwindows(startdate(), now), now)
+        reference = refreshed is None or started - refreshed >= refresh
+        try:
+            syncwindows(windows, reference)
+            if reference:
+                refreshed = started
+        except Exception:
+            if WRITER.error is not None:
+                raise
+            LOGGER.exception('Sync cycle failed, retrying in the next cycle')
+        savestate(ARGUMENTS.state)
+        if CACHE is not None:
+            CACHE.save()
+        if ARCHIVE is not None:
+            ARCHIVE.save()
+        reportmetrics(reported)
+        stop.wait(max(0, interval - (time.monotonic() - started)))
 
 if __name__ == "__main__":
     main()
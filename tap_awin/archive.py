@@ -0,0 +1,127 @@
+import os
+import json
+import zlib
+import hashlib
+import threading
+from tap_awin.cache import login
+
+
+class Recorder(object):
+    # Tees the chunks of a streamed response into a hash and a gzip stream
+    # while it is parsed, so capturing keeps the response streamed.
+    def __init__(self, response):
+        self.hash = hashlib.sha256()
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self.parts = []
+        chunks = response.iter_content
+        def tee(chunk_size=1, decode_unicode=False):
+            for chunk in chunks(chunk_size=chunk_size):
+                self.hash.update(chunk)
+                self.parts.append(self.compressor.compress(chunk))
+                yield chunk
+        response.iter_content = tee
+
+    def digest(self):
+        return self.hash.hexdigest()
+
+    def compressed(self):
+        return b''.join(self.parts) + self.compressor.flush()
+
+
+class Archive(object):
+    # Raw response bodies stored gzip compressed under their sha256, and per
+    # window a manifest of request key (endpoint, params without the dates
+    # and a hash of the access token) -> hashes of the bodies in request
+    # order. A request split into date sub-ranges has one hash per sub-range.
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.manifests = {}
+        self.recorded = set()
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'windows'), exist_ok=True)
+
+    @staticmethod
+    def key(path, params):
+        keyed = sorted((k, str(v)) for k, v in (params or {}).items()
+                       if k not in ('accessToken', 'startDate', 'endDate'))
+        return json.dumps([path, keyed, login(params)])
+
+    def objectpath(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest + '.gz')
+
+    def manifestpath(self, window):
+        return os.path.join(self.directory, 'windows', window.replace(':', '') + '.json')
+
+    def manifest(self, window):
+        with self.lock:
+            if window not in self.manifests:
+                try:
+                    with open(self.manifestpath(window)) as manifest:
+                        self.manifests[window] = json.load(manifest)
+                except (IOError, ValueError):
+                    self.manifests[window] = {}
+            return self.manifests[window]
+
+    def record(self, window, path, params, body):
+        # body is the content of a response or the Recorder of a streamed one.
+        if isinstance(body, Recorder):
+            digest, compressed = body.digest(), body.compressed()
+        else:
+            digest, compressed = hashlib.sha256(body).hexdigest(), None
+        target = self.objectpath(digest)
+        if not os.path.exists(target):
+            if compressed is None:
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+                compressed = compressor.compress(body) + compressor.flush()
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temporary = target + '.' + str(threading.get_ident()) + '.tmp'
+            with open(temporary, 'wb') as archived:
+                archived.write(compressed)
+            os.replace(temporary, target)
+        manifest = self.manifest(window)
+        key = self.key(path, params)
+        with self.lock:
+            # The first body of a request in this run replaces what an
+            # earlier, unfinished run of the window captured.
+            if (window, key) not in self.recorded:
+                self.recorded.add((window, key))
+                manifest[key] = []
+            manifest[key].append(digest)
+
+    def replay(self, window, path, params, anywindow=False):
+        # Hashes of the bodies captured for the request in window, None when
+        # there are none. With anywindow the latest earlier (or else the
+        # first later) window that has the request is used.
+        key = self.key(path, params)
+        digests = self.manifest(window).get(key)
+        if digests is None and anywindow:
+            windows = sorted(name[:-5] for name in
+                             os.listdir(os.path.join(self.directory, 'windows'))
+                             if name.endswith('.json'))
+            current = window.replace(':', '')
+            for name in [name for name in reversed(windows) if name <= current] + \
+                        [name for name in windows if name > current]:
+                try:
+                    with open(os.path.join(self.directory, 'windows', name + '.json')) as manifest:
+                        digests = json.load(manifest).get(key)
+                except (IOError, ValueError):
+                    continue
+                if digests is not None:
+                    break
+        return digests
+
+    def read(self, digest):
+        with open(self.objectpath(digest), 'rb') as archived:
+            return zlib.decompress(archived.read(), 31)
+
+    def save(self):
+        # Requests of a later run (or daemon cycle) replace the saved bodies.
+        with self.lock:
+            windows = set(window for window, _ in self.recorded)
+            for window in windows:
+                path = self.manifestpath(window)
+                with open(path + '.tmp', 'w') as manifest:
+                    json.dump(self.manifests[window], manifest, sort_keys=True)
+                os.replace(path + '.tmp', path)
+            self.recorded = set()
@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+class CachedResponse(object):
+    # Stands in for a requests response whose body is already in memory.
+    url = ''
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+def login(params):
+    # Requests of different logins must not share entries, the token itself
+    # is not stored.
+    token = (params or {}).get('accessToken')
+    return hashlib.sha1(token.encode('utf-8')).hexdigest()[:16] if token else None
+
+
+class ResponseCache(object):
+    # Response bodies of slow changing endpoints stored one file per request
+    # with an index of content hash, size and fetch/use times. Entries younger
+    # than the caller's ttl are served from disk, the least recently used ones
+    # are evicted once the cache grows past max_bytes.
+    def __init__(self, directory, max_bytes=104857600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(os.path.join(directory, 'index.json')) as index:
+                self.index = json.load(index)
+        except (IOError, ValueError):
+            self.index = {}
+        self.size = sum(entry['size'] for entry in self.index.values())
+
+    @staticmethod
+    def key(path, params):
+        keyed = sorted((k, str(v)) for k, v in (params or {}).items() if k != 'accessToken')
+        return hashlib.sha1(json.dumps([path, keyed, login(params)]).encode('utf-8')).hexdigest()
+
+    def read(self, name):
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as entry:
+                return entry.read()
+        except IOError:
+            return None
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path + '.tmp', 'wb') as entry:
+            entry.write(content)
+        os.replace(path + '.tmp', path)
+
+    def get(self, path, params, ttl, fetch):
+        # Returns (response, changed), changed is False when the body is the
+        # one whose records were written last (see emitted). A body that was
+        # fetched but not written, e.g. of an unselected stream, is changed.
+        name = self.key(path, params)
+        now = time.time()
+        with self.lock:
+            entry = self.index.get(name)
+        if entry is not None and now - entry['fetched'] < ttl:
+            content = self.read(name)
+            if content is not None:
+                with self.lock:
+                    entry['used'] = now
+                return CachedResponse(content), entry.get('emitted') != entry['hash']
+        response = fetch()
+        if response.status_code != 200:
+            return response, True
+        digest = hashlib.sha256(response.content).hexdigest()
+        self.write(name, response.content)
+        with self.lock:
+            previous = self.index.get(name)
+            emitted = None
+            if previous is not None:
+                self.size -= previous['size']
+                emitted = previous.get('emitted')
+            self.index[name] = {'hash':digest, 'size':len(response.content),
+                                'fetched':now, 'used':now, 'emitted':emitted}
+            self.size += len(response.content)
+            if self.size > self.max_bytes:
+                self.evict()
+        return response, emitted != digest
+
+    def emitted(self, path, params, content):
+        # Remembers that the records of this body were written.
+        name = self.key(path, params)
+        digest = hashlib.sha256(content).hexdigest()
+        with self.lock:
+            if name in self.index:
+                self.index[name]['emitted'] = digest
+
+    def evict(self):
+        for name in sorted(self.index, key=lambda name: self.index[name]['used']):
+            if self.size <= self.max_bytes:
+                break
+            self.size -= self.index.pop(name)['size']
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def save(self):
+        path = os.path.join(self.directory, 'index.json')
+        with self.lock:
+            with open(path + '.tmp', 'w') as index:
+                json.dump(self.index, index)
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,57 @@
+import json
+import sqlite3
+import hashlib
+import threading
+
+
+def fingerprint(record, ignore=('startDate', 'endDate')):
+    content = json.dumps(dict((k, v) for k, v in record.items() if k not in ignore),
+                         sort_keys=True, default=str)
+    # First 8 bytes of sha1, blake2b is not available on python 3.5.
+    return int.from_bytes(hashlib.sha1(content.encode('utf-8')).digest()[:8], 'big', signed=True)
+
+
+class ChangeIndex(object):
+    # sqlite index of (transaction id, commission group) -> fingerprint of the
+    # last emitted version. New fingerprints are staged per window and only
+    # become visible once that window is checkpointed, so rows of a window
+    # that never completed are emitted again on the next run.
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS transactions '
+                                '(id INTEGER NOT NULL, part INTEGER NOT NULL, '
+                                'fingerprint INTEGER NOT NULL, PRIMARY KEY (id, part)) '
+                                'WITHOUT ROWID')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS pending '
+                                '(window TEXT NOT NULL, id INTEGER NOT NULL, '
+                                'part INTEGER NOT NULL, fingerprint INTEGER NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS pending_window ON pending (window)')
+        self.connection.execute('DELETE FROM pending')
+        self.connection.commit()
+
+    def changed(self, window, record):
+        key = (record['id'], record.get('commissionGroupId') or 0)
+        value = fingerprint(record)
+        with self.lock:
+            row = self.connection.execute('SELECT fingerprint FROM transactions '
+                                          'WHERE id = ? AND part = ?', key).fetchone()
+            if row is not None and row[0] == value:
+                return False
+            self.connection.execute('INSERT INTO pending VALUES (?, ?, ?, ?)',
+                                    (window,) + key + (value,))
+            return True
+
+    def checkpoint(self, window):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO transactions '
+                                    'SELECT id, part, fingerprint FROM pending WHERE window = ?',
+                                    (window,))
+            self.connection.execute('DELETE FROM pending WHERE window = ?', (window,))
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,280 @@
+import codecs
+import json
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+import requests
+from requests.adapters import HTTPAdapter
+
+API_URL = 'https://api.awin.com'
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket(object):
+    # Awin enforces a per-minute call quota per user, so tokens refill
+    # continuously at rate/per and at most `capacity` calls may burst. With a
+    # maximum above rate, adapt probes for the real quota: the rate grows by
+    # the starting rate per `per` seconds of successful calls and halves on
+    # a congestion signal, at most once per `cooldown` seconds.
+    def __init__(self, rate, per=60.0, capacity=None, maximum=None, cooldown=1.0):
+        self.rate = float(rate) / per
+        self.step = self.rate
+        self.minimum = min(self.rate, 1.0 / per)
+        self.maximum = max(self.rate, float(maximum or rate) / per)
+        self.per = per
+        self.cooldown = cooldown
+        self.decreased = 0.0
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def adapt(self, congested=False):
+        with self.lock:
+            if congested:
+                now = time.monotonic()
+                if now - self.decreased >= self.cooldown:
+                    self.rate = max(self.minimum, self.rate / 2)
+                    self.decreased = now
+            else:
+                # One call takes 1 / rate seconds of the quota, so the rate
+                # grows by `step` per `per` seconds spent at it.
+                self.rate = min(self.maximum, self.rate + self.step / (self.rate * self.per))
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class AdaptiveLimit(object):
+    # Caps the requests in flight. The cap grows by about one per round of
+    # successful calls and halves on a congestion signal (429 or a response
+    # slower than the latency target), at most once per `cooldown` seconds.
+    # It starts at half the maximum so there is room to grow.
+    def __init__(self, maximum, initial=None, cooldown=1.0):
+        self.maximum = float(maximum)
+        self.limit = float(initial or max(1.0, self.maximum / 2))
+        self.cooldown = cooldown
+        self.inflight = 0
+        self.decreased = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.inflight >= int(self.limit):
+                self.condition.wait()
+            self.inflight += 1
+
+    def release(self, congested=False):
+        with self.condition:
+            self.inflight -= 1
+            now = time.monotonic()
+            if congested:
+                if now - self.decreased >= self.cooldown:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.decreased = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+
+def retryafter(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Client(object):
+    def __init__(self, user_agent, rate_limit=20, burst=None, api_url=API_URL,
+                 timeout=300, pool_size=10, max_retries=5, backoff_base=1.0,
+                 backoff_max=60.0, latency_target=None, metrics=None, rate_limit_max=None):
+        self.api_url = api_url.rstrip('/')
+        self.metrics = metrics
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.latency_target = latency_target
+        self.limiter = TokenBucket(rate_limit, 60, burst, maximum=rate_limit_max)
+        self.inflight = AdaptiveLimit(pool_size)
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': user_agent})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def settle(self, congested):
+        # A finished call feeds both the in flight cap and the call rate.
+        self.inflight.release(congested)
+        self.limiter.adapt(congested)
+
+    def hold(self, response, congested):
+        # A streamed body counts as in flight until the response is closed.
+        close = response.close
+        settled = []
+        def closeandsettle():
+            try:
+                close()
+            finally:
+                if not settled:
+                    settled.append(True)
+                    self.settle(congested)
+        response.close = closeandsettle
+
+    def observe(self, metric, *args, **tags):
+        if self.metrics is not None:
+            getattr(self.metrics, metric)(*args, **tags)
+
+    def get(self, path, params=None, stream=False, tags=None, retry_timeouts=True):
+        # Retries 429/5xx responses and connection errors, waiting for the
+        # server's Retry-After when given and a jittered exponential backoff
+        # otherwise. The last response (or error) is returned (or raised).
+        # tags label the metrics of the call, e.g. stream and account.
+        # Without retry_timeouts a timeout is raised at once, for callers
+        # that rather request less on a timeout.
+        # A streamed 200 response keeps its in flight slot until it is closed.
+        tags = tags or {}
+        attempt = 0
+        while True:
+            self.inflight.acquire()
+            congested = False
+            held = False
+            try:
+                self.observe('add', 'sleep_seconds', self.limiter.acquire(), reason='rate_limit',
+                             **tags)
+                started = time.monotonic()
+                try:
+                    response = self.session.get(self.api_url + path, params=params,
+                                                timeout=self.timeout, stream=stream)
+                except (requests.ConnectionError, requests.Timeout):
+                    self.observe('request', time.monotonic() - started, 0, path, **tags)
+                    raise
+                elapsed = time.monotonic() - started
+                self.observe('request', elapsed, response.status_code, path, **tags)
+                congested = response.status_code == 429 or \
+                            (self.latency_target is not None and elapsed > self.latency_target)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                congested = True
+                if attempt >= self.max_retries or \
+                   (not retry_timeouts and isinstance(exc, requests.Timeout)):
+                    raise
+                delay = self.backoff(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    if not stream:
+                        self.observe('received', len(response.content), **tags)
+                    elif self.metrics is not None:
+                        response.on_consumed = partial(self.metrics.received, **tags)
+                    if stream and response.status_code == 200:
+                        self.hold(response, congested)
+                        held = True
+                    return response
+                delay = retryafter(response)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                response.close()
+            finally:
+                if not held:
+                    self.settle(congested)
+            self.observe('add', 'retries', 1, **tags)
+            self.observe('add', 'sleep_seconds', delay, reason='backoff', **tags)
+            time.sleep(delay)
+            attempt += 1
+
+
+def iter_json_array(response, chunk_size=65536):
+    # Yields the items of a top level JSON array as they arrive so only the
+    # current chunk and item are held in memory, not the whole body.
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = response.iter_content(chunk_size=chunk_size)
+    buffer = ''
+    position = 0
+    received = 0
+    started = False
+    exhausted = False
+    try:
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer):
+                if not started:
+                    if buffer[position] != '[':
+                        raise ValueError('Expected a JSON array in response from ' +
+                                         response.url)
+                    started = True
+                    position += 1
+                    continue
+                if buffer[position] == ']':
+                    return
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    if exhausted:
+                        raise
+                else:
+                    # A number cut at the chunk boundary still decodes, so
+                    # only trust items followed by a delimiter.
+                    if exhausted or (end < len(buffer) and buffer[end] in ' \t\r\n,]'):
+                        yield item
+                        position = end
+                        continue
+            if exhausted:
+                raise ValueError('Unexpected end of JSON array in response from ' + response.url)
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+                buffer = buffer[position:] + utf8.decode(b'', final=True)
+            else:
+                received += len(chunk)
+                buffer = buffer[position:] + utf8.decode(chunk)
+            position = 0
+    finally:
+        response.close()
+        if hasattr(response, 'on_consumed'):
+            response.on_consumed(received)
+
+
+def ordered_map(func, items, max_workers=1):
+    # Like Executor.map, but keeps at most 2 * max_workers calls pending so
+    # large fan-outs do not buffer every response before the first is consumed.
+    if max_workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    pending = deque()
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for item in islice(items, 2 * max_workers):
+            pending.append(executor.submit(func, item))
+        while pending:
+            result = pending.popleft().result()
+            for item in islice(items, 1):
+                pending.append(executor.submit(func, item))
+            yield result
@@ -0,0 +1,153 @@
+import os
+import csv
+import gzip
+import time
+import threading
+import singer
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+LOGGER = singer.get_logger()
+
+
+def arrowschema(schema):
+    types = {'number': pyarrow.float64(), 'integer': pyarrow.int64(),
+             'boolean': pyarrow.bool_(), 'string': pyarrow.string()}
+    fields = []
+    for name, spec in schema['properties'].items():
+        kind = [kind for kind in spec.get('type', []) if kind != 'null']
+        fields.append(pyarrow.field(name, types.get(kind[0] if kind else None, pyarrow.string())))
+    return pyarrow.schema(fields)
+
+
+class ParquetFile(object):
+    extension = '.parquet'
+
+    def __init__(self, path, schema):
+        self.schema = arrowschema(schema)
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, columns):
+        self.writer.write_batch(pyarrow.record_batch(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class ArrowFile(object):
+    extension = '.arrow'
+
+    def __init__(self, path, schema):
+        self.schema = arrowschema(schema)
+        self.sink = pyarrow.OSFile(path, 'wb')
+        self.writer = pyarrow.ipc.new_file(self.sink, self.schema,
+                                           options=pyarrow.ipc.IpcWriteOptions(compression='zstd'))
+
+    def write(self, columns):
+        self.writer.write_batch(pyarrow.record_batch(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+class CsvFile(object):
+    extension = '.csv.gz'
+
+    def __init__(self, path, schema):
+        self.file = gzip.open(path, 'wt', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(list(schema['properties']))
+
+    def write(self, columns):
+        self.writer.writerows(zip(*[['' if value is None else value for value in column]
+                                    for column in columns]))
+
+    def close(self):
+        self.file.close()
+
+
+FORMATS = {'parquet': ParquetFile, 'arrow': ArrowFile, 'csv': CsvFile}
+
+
+class ColumnarSink(object):
+    # Records of the configured streams collected column by column and
+    # written in batches of batch_rows to one file per stream and window
+    # segment, <directory>/<stream>/<window>.<run>.<n><extension>. Files are
+    # written under a .tmp name and renamed once their segment is closed, so
+    # a loader only sees complete files, the segments that did not finish
+    # are discarded. Columns are the properties of the schema.
+    def __init__(self, directory, streams, fileformat=None, batch_rows=50000):
+        if fileformat is None:
+            fileformat = 'parquet' if pyarrow is not None else 'csv'
+        if fileformat not in FORMATS:
+            raise ValueError('columnar_format should be one of ' + ', '.join(sorted(FORMATS)))
+        if fileformat != 'csv' and pyarrow is None:
+            raise ValueError(fileformat + ' output needs pyarrow (pip install tap_awin[columnar])')
+        self.directory = directory
+        self.streams = set(streams)
+        self.fileclass = FORMATS[fileformat]
+        self.batch_rows = batch_rows
+        self.run = time.strftime('%Y%m%dT%H%M%S', time.gmtime()) + '-' + str(os.getpid())
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.open = {}
+
+    def write(self, stream, schema, window, record):
+        with self.lock:
+            key = (stream, window)
+            if key not in self.open:
+                self.sequence += 1
+                path = os.path.join(self.directory, stream, window.replace(':', '') + '.' +
+                                    self.run + '.' + str(self.sequence) +
+                                    self.fileclass.extension)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                names = list(schema['properties'])
+                self.open[key] = {'path':path, 'file':self.fileclass(path + '.tmp', schema),
+                                  'names':names, 'columns':[[] for _ in names], 'rows':0}
+            batch = self.open[key]
+            for name, column in zip(batch['names'], batch['columns']):
+                column.append(record.get(name))
+            batch['rows'] += 1
+            if len(batch['columns'][0]) >= self.batch_rows:
+                self.flush(batch)
+
+    @staticmethod
+    def flush(batch):
+        if batch['columns'][0]:
+            batch['file'].write(batch['columns'])
+            batch['columns'] = [[] for _ in batch['names']]
+
+    def matching(self, window=None, stream=None):
+        return [key for key in self.open
+                if window in (None, key[1]) and stream in (None, key[0])]
+
+    def close(self, window, stream=None):
+        # Finishes the files of window (of one stream only when given), rows
+        # written after this start a new file.
+        with self.lock:
+            for key in self.matching(window, stream):
+                batch = self.open.pop(key)
+                self.flush(batch)
+                batch['file'].close()
+                os.replace(batch['path'] + '.tmp', batch['path'])
+                LOGGER.info('Wrote ' + str(batch['rows']) + ' ' + key[0] + ' rows to ' +
+                            batch['path'])
+
+    def discard(self, window=None, stream=None):
+        # Removes the unfinished files (of a window and stream when given),
+        # their accounts are synced again by the next run.
+        with self.lock:
+            for key in self.matching(window, stream):
+                batch = self.open.pop(key)
+                try:
+                    batch['file'].close()
+                finally:
+                    os.remove(batch['path'] + '.tmp')
+                LOGGER.info('Discarded ' + str(batch['rows']) + ' ' + key[0] +
+                            ' rows of unfinished window ' + key[1])
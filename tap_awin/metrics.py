@@ -0,0 +1,97 @@
+import os
+import json
+import threading
+from collections import defaultdict
+
+BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+
+def labelset(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+class Metrics(object):
+    # Per request and per stream measurements. Every observation is logged as
+    # a Singer METRIC line and aggregated for an optional Prometheus textfile
+    # written at the end of the run.
+    def __init__(self, logger):
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def log(self, kind, metric, value, tags):
+        tags = dict((k, v) for k, v in tags.items() if v is not None)
+        self.logger.info('METRIC: ' + json.dumps({'type':kind, 'metric':metric, 'value':value,
+                                                  'tags':tags}))
+
+    def add(self, name, value, **labels):
+        with self.lock:
+            self.counters[(name, labelset(labels))] += value
+
+    def request(self, seconds, status, path, **labels):
+        self.log('timer', 'http_request_duration', seconds,
+                 dict(labels, endpoint=path, http_status_code=status,
+                      status='succeeded' if status == 200 else 'failed'))
+        key = labelset(labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+            histogram = self.histograms[key]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def received(self, nbytes, **labels):
+        self.add('response_bytes', nbytes, **labels)
+
+    def rows(self, count, **labels):
+        self.log('counter', 'rows_received', count, labels)
+        self.add('rows_received', count, **labels)
+
+    def records(self, count, **labels):
+        self.log('counter', 'record_count', count, labels)
+        self.add('records', count, **labels)
+
+    def rejected(self, count, **labels):
+        self.log('counter', 'rejected_count', count, labels)
+        self.add('rejected', count, **labels)
+
+    def job(self, seconds, **labels):
+        self.log('timer', 'job_duration', seconds, labels)
+        self.add('stream_seconds', seconds, **labels)
+
+    def prometheus(self):
+        def render(labels, extra=()):
+            labels = labels + tuple(extra)
+            if not labels:
+                return ''
+            return '{' + ','.join('%s="%s"' % (k, v.replace('\\', '\\\\').replace('"', '\\"'))
+                                  for k, v in labels) + '}'
+        lines = []
+        with self.lock:
+            names = sorted(set(name for name, _ in self.counters))
+            for name in names:
+                metric = 'awin_' + name + '_total'
+                lines.append('# TYPE ' + metric + ' counter')
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(metric + render(labels) + ' ' + repr(value))
+            if self.histograms:
+                metric = 'awin_request_duration_seconds'
+                lines.append('# TYPE ' + metric + ' histogram')
+                for labels, (buckets, total, count) in sorted(self.histograms.items()):
+                    for bound, value in zip(BUCKETS, buckets):
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(metric + '_bucket' + render(labels, [('le', le)]) +
+                                     ' ' + str(value))
+                    lines.append(metric + '_sum' + render(labels) + ' ' + repr(total))
+                    lines.append(metric + '_count' + render(labels) + ' ' + str(count))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        with open(path + '.tmp', 'w') as textfile:
+            textfile.write(self.prometheus())
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def run_graph(tasks, max_parallel=1):
+    # tasks is an ordered list of (name, func, dependencies); a task starts once
+    # all of its dependencies finished, ready tasks start in list order.
+    names = set(name for name, _, _ in tasks)
+    for name, _, dependencies in tasks:
+        missing = set(dependencies) - names
+        if missing:
+            raise ValueError('Task ' + name + ' depends on unknown tasks: ' +
+                             ', '.join(sorted(missing)))
+    done = set()
+    waiting = list(tasks)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+        while waiting or running:
+            for task in [task for task in waiting if done.issuperset(task[2])]:
+                if len(running) >= max_parallel:
+                    break
+                waiting.remove(task)
+                running[executor.submit(task[1])] = task[0]
+            if not running:
+                raise ValueError('Circular dependency between tasks: ' +
+                                 ', '.join(task[0] for task in waiting))
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                if future.exception() is not None:
+                    waiting = []
+                    future.result()
+                done.add(name)
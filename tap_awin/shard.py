@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Deterministic split of the per account work across N tap invocations and
+# the merge of their states back into one.
+#
+#   tap-awin --config config.json --state state-0.json --shard 0/4 ...
+#   tap-awin-merge-state state-0.json state-1.json state-2.json state-3.json > state.json
+
+import sys
+import json
+import zlib
+import argparse
+
+
+def parseshard(text):
+    try:
+        index, count = [int(part) for part in text.split('/')]
+    except ValueError:
+        raise ValueError('shard should be i/N, e.g. 0/4')
+    if count < 1 or not 0 <= index < count:
+        raise ValueError('shard index should be between 0 and N-1')
+    return index, count
+
+
+def owns(shard, key):
+    # key is the account ("advertiser/123") or publisher/advertiser pair a
+    # unit of work belongs to, crc32 keeps the split stable across processes.
+    if shard is None:
+        return True
+    index, count = shard
+    return zlib.crc32(key.encode('utf-8')) % count == index
+
+
+def mergestates(states):
+    # Shards advance independently, the merged state resumes from the shard
+    # that is furthest behind. Windows after it that some shards already
+    # finished are synced again, accounts bookmarked by any shard in a window
+    # that did not finish are kept.
+    states = [state for state in states if state]
+    if not states:
+        return {}
+    started = [state for state in states if 'last_fetched' in state]
+    if len(started) < len(states):
+        merged = dict((k, v) for k, v in states[0].items() if k != 'last_fetched')
+    else:
+        merged = dict(min(started, key=lambda state: state['last_fetched']))
+    merged.pop('shard', None)
+    bookmarks = {}
+    for state in states:
+        for window, streams in state.get('bookmarks', {}).items():
+            if window <= merged.get('last_fetched', ''):
+                continue
+            for stream, keys in streams.items():
+                merge = bookmarks.setdefault(window, {}).setdefault(stream, [])
+                merge.extend(key for key in keys if key not in merge)
+    merged.pop('bookmarks', None)
+    if bookmarks:
+        merged['bookmarks'] = bookmarks
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge the states of tap-awin --shard runs')
+    parser.add_argument('states', nargs='+', help='State files of the shards')
+    args = parser.parse_args()
+    states = []
+    for path in args.states:
+        with open(path) as state:
+            states.append(json.load(state))
+    json.dump(mergestates(states), sys.stdout)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Record reshaping steps. Each step builder returns a function that edits a
+# record in place; compile_transform chains them once per stream and window so
+# per record work is only the edits themselves.
+
+def amount(field, currency):
+    # {"amount": 1.5, "currency": "EUR"} -> field=1.5, currency="EUR"
+    def step(record):
+        value = record.get(field)
+        if value is not None:
+            record[currency] = value['currency']
+            record[field] = value['amount']
+    return step
+
+
+def merge(field):
+    def step(record):
+        value = record.pop(field, None)
+        if value is not None:
+            record.update(value)
+    return step
+
+
+def keyvalue(field):
+    # [{"key": k, "value": v}, ...] -> "{k: v, ...}"
+    def step(record):
+        value = record.get(field)
+        if value is not None:
+            record[field] = str(dict((i['key'], i['value']) for i in value))
+    return step
+
+
+def region(field):
+    def step(record):
+        value = record.pop(field, None)
+        if value is not None:
+            record['countryName'] = value['name']
+            record['countryCode'] = value['countryCode']
+    return step
+
+
+def join(field, key):
+    def step(record):
+        value = record.get(field)
+        if value is not None:
+            record[field] = ','.join(i[key] for i in value)
+    return step
+
+
+def commissionrange(field, rangetype, minimum, maximum):
+    def step(record):
+        for i in record.get(field) or []:
+            if i['type'] == rangetype:
+                record[minimum], record[maximum] = i['min'], i['max']
+                break
+    return step
+
+
+def compile_transform(steps, constants=None, explode=None):
+    # Returns record -> iterable of records. With `explode`, one record is
+    # produced per entry of that list field; the same dict is updated and
+    # yielded for each entry so it must be consumed before the next one.
+    steps = tuple(steps)
+    constants = dict(constants or {})
+
+    def explodeparts(record, parts):
+        for part in parts:
+            record.update(part)
+            yield record
+
+    def transform(record):
+        for step in steps:
+            step(record)
+        record.update(constants)
+        if explode is not None:
+            parts = record.pop(explode, None)
+            if parts is not None:
+                return explodeparts(record, parts)
+        return (record,)
+    return transform
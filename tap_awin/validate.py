@@ -0,0 +1,120 @@
+import json
+import math
+import threading
+from decimal import Decimal
+
+MISSING = object()
+NUMBERS = (int, float, Decimal)
+
+
+def number(value):
+    if isinstance(value, str):
+        text = value.strip()
+        try:
+            return int(text)
+        except ValueError:
+            pass
+        try:
+            value = float(text)
+        except ValueError:
+            raise ValueError('expected a number, got ' + repr(value))
+        if math.isfinite(value):
+            return value
+    raise ValueError('expected a number, got ' + repr(value))
+
+
+def boolean(value):
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+        return value.strip().lower() == 'true'
+    if value.__class__ is int and value in (0, 1):
+        return bool(value)
+    raise ValueError('expected a boolean, got ' + repr(value))
+
+
+def string(value):
+    if value.__class__ in NUMBERS:
+        return str(value)
+    raise ValueError('expected a string, got ' + repr(value))
+
+
+def anything(value):
+    return value
+
+
+# JSON schema type -> (python types accepted as they are, coercion of others)
+TYPES = [('number', (int, float, Decimal), number),
+         ('integer', (int,), number),
+         ('boolean', (bool,), boolean),
+         ('string', (str,), string)]
+
+
+def compile_field(spec):
+    types = spec.get('type', [])
+    if isinstance(types, str):
+        types = [types]
+    for name, accepted, convert in TYPES:
+        if name in types:
+            break
+    else:
+        accepted, convert = (), anything
+    nullable = 'null' in types
+    if nullable:
+        accepted = accepted + (type(None),)
+    def coerce(value):
+        # Empty strings of non string fields are nulls.
+        if value is None or (value == '' and convert is not string):
+            if nullable:
+                return None
+            raise ValueError('is null')
+        return convert(value)
+    return frozenset(accepted), coerce
+
+
+def compile_validator(schema, shapes=1024):
+    # Returns record -> list of errors (None when valid). Values without an
+    # accepted type are coerced in place, e.g. "12.5" for a number or "" for
+    # a nullable number, fields not in the schema are left alone. Rows of one
+    # endpoint mostly share their keys and value types, so shapes (up to
+    # `shapes` of them) that passed unchanged are remembered and a record of
+    # a known shape is accepted without looking at its fields.
+    fields = [(name,) + compile_field(spec) for name, spec in schema['properties'].items()]
+    valid = set()
+    def validate(record):
+        shape = (tuple(record), tuple(map(type, record.values())))
+        if shape in valid:
+            return None
+        errors = check(record)
+        if errors is None and len(valid) < shapes and \
+           shape == (tuple(record), tuple(map(type, record.values()))):
+            valid.add(shape)
+        return errors
+    def check(record):
+        errors = None
+        for name, accepted, coerce in fields:
+            value = record.get(name, MISSING)
+            if value.__class__ in accepted or value is MISSING:
+                continue
+            try:
+                record[name] = coerce(value)
+            except ValueError as exc:
+                if errors is None:
+                    errors = []
+                errors.append(name + ': ' + str(exc))
+        return errors
+    return validate
+
+
+class RejectFile(object):
+    # JSON lines of records that failed validation with their errors.
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, 'a')
+
+    def write(self, stream, record, errors):
+        line = json.dumps({'stream':stream, 'errors':errors, 'record':record}, default=str)
+        with self.lock:
+            self.file.write(line + '\n')
+
+    def close(self):
+        with self.lock:
+            self.file.close()
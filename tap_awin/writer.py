@@ -0,0 +1,184 @@
+import sys
+import json
+import threading
+import queue
+from collections import Counter
+from contextlib import contextmanager
+from decimal import Decimal
+import singer
+from tap_awin.validate import compile_validator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encodedefault(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError('Object of type ' + type(value).__name__ + ' is not JSON serializable')
+
+
+def encode(message):
+    if orjson is not None:
+        return orjson.dumps(message.asdict(), default=encodedefault) + b'\n'
+    return (json.dumps(message.asdict(), separators=(',', ':'), allow_nan=False,
+                       default=encodedefault) + '\n').encode('utf-8')
+
+
+class SingerWriter(object):
+    # Streams run on worker threads; they encode their own messages and hand
+    # the lines to one writer thread so stdout never interleaves partial lines.
+    # Lines are written in batches of up to buffer_size bytes and stdout is
+    # flushed after every STATE message so a checkpoint is never ahead of the
+    # records it covers. With validate, records are checked and coerced
+    # against the last schema written for their stream. Invalid ones go to
+    # rejects (a RejectFile) instead of stdout, without rejects they are
+    # logged and written as coerced so far.
+    def __init__(self, maxsize=10000, buffer_size=1048576, validate=False, rejects=None):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.buffer_size = buffer_size
+        self.thread = None
+        self.error = None
+        self.records = Counter()
+        self.validate = validate
+        self.validators = {}
+        self.rejects = rejects
+        self.rejected = Counter()
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='singer-writer', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.drain()
+        except Exception as exc:
+            # Keep consuming so producers blocked on a full queue see the error.
+            self.error = exc
+            while self.queue.get() is not None:
+                pass
+
+    def drain(self):
+        output = getattr(sys.stdout, 'buffer', None)
+        def write(lines):
+            if output is not None:
+                output.write(b''.join(lines))
+            else:
+                sys.stdout.write(b''.join(lines).decode('utf-8'))
+        pending = []
+        size = 0
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            line, flush, stream = item
+            if stream is not None:
+                self.records[stream] += 1
+            pending.append(line)
+            size += len(line)
+            if flush or size >= self.buffer_size or self.queue.empty():
+                write(pending)
+                pending = []
+                size = 0
+                if flush:
+                    (output or sys.stdout).flush()
+                    # flush is the Event of a sync call
+                    if flush is not True:
+                        flush.set()
+        write(pending)
+        (output or sys.stdout).flush()
+
+    def write_message(self, message):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((encode(message), isinstance(message, singer.StateMessage),
+                        message.stream if isinstance(message, singer.RecordMessage) else None))
+
+    def write_record(self, stream_name, record):
+        if self.accept(stream_name, record):
+            self.write_message(singer.RecordMessage(stream=stream_name, record=record))
+
+    def accept(self, stream_name, record):
+        validator = self.validators.get(stream_name)
+        if validator is not None:
+            errors = validator(record)
+            if errors:
+                self.reject(stream_name, record, errors)
+                return self.rejects is None
+        return True
+
+    def reject(self, stream_name, record, errors):
+        with self.lock:
+            self.rejected[stream_name] += 1
+        if self.rejects is not None:
+            self.rejects.write(stream_name, record, errors)
+        else:
+            singer.get_logger().warning('Invalid ' + stream_name + ' record: ' +
+                                        '; '.join(errors))
+
+    def write_schema(self, stream_name, schema, key_properties):
+        if self.validate:
+            self.validators[stream_name] = compile_validator(schema)
+        self.write_message(singer.SchemaMessage(stream=stream_name, schema=schema,
+                                                key_properties=key_properties))
+
+    def write_state(self, value):
+        self.write_message(singer.StateMessage(value=value))
+
+    def sync(self):
+        # Waits until everything written so far is on stdout and flushed.
+        if self.thread is None:
+            return
+        done = threading.Event()
+        self.queue.put((b'', done, None))
+        while not done.wait(1):
+            if self.error is not None:
+                raise self.error
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise self.error
+
+
+class SchemaGate(object):
+    # One Singer stream written by several tap streams with different
+    # schemas (the two reports). Holders of the same schema write together,
+    # a holder of another schema waits until they are done and writes its
+    # SCHEMA message again, so records always follow their own schema. New
+    # holders queue behind a waiting one so neither schema starves.
+    def __init__(self, writer, stream, key_properties):
+        self.writer = writer
+        self.stream = stream
+        self.key_properties = key_properties
+        self.condition = threading.Condition()
+        self.schema = None
+        self.active = 0
+        self.waiting = 0
+
+    @contextmanager
+    def hold(self, schema):
+        with self.condition:
+            queued = 0
+            while self.active and (self.schema is not schema or self.waiting > queued):
+                if not queued:
+                    queued = 1
+                    self.waiting += 1
+                self.condition.wait()
+            self.waiting -= queued
+            if self.schema is not schema:
+                self.writer.write_schema(self.stream, schema, self.key_properties)
+                self.schema = schema
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
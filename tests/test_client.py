@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import json
+import pytest
+from tap_awin.cache import CachedResponse
+from tap_awin.client import iter_json_array
+
+ITEMS = [1, -2.5, 3e-7, 1234567890123, 0, True, None, 'a]b,c[', u'café € \U0001f600',
+         {'id': 10007544459, 'url': 'https://example.com/x?a=1]', 'parts': [1, [2, 3]]},
+         [], {}, '', '\\"]']
+
+
+def parse(body, chunk_size):
+    return list(iter_json_array(CachedResponse(body), chunk_size=chunk_size))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7])
+@pytest.mark.parametrize('separators', [(',', ':'), (', ', ': '), (' ,\n', ' : ')])
+def test_items_across_chunk_boundaries(chunk_size, separators):
+    body = json.dumps(ITEMS, separators=separators, ensure_ascii=False).encode('utf-8')
+    assert parse(body, chunk_size) == ITEMS
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7])
+@pytest.mark.parametrize('body', [b'[]', b' [ ] ', b'[12345]', b'[\n12345\n]', b'[-0.125]'])
+def test_single_number_and_empty(chunk_size, body):
+    assert parse(body, chunk_size) == json.loads(body.decode('utf-8'))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7])
+@pytest.mark.parametrize('body', [b'[{"id": 1, "url": "x"', b'[1, 2', b'[12', b'[',
+                                  b'["\xe2\x82', b'{"error": "x"}', b''])
+def test_truncated_or_not_an_array(chunk_size, body):
+    with pytest.raises(ValueError):
+        parse(body, chunk_size)
@@ -0,0 +1,29 @@
+import csv
+import gzip
+from tap_awin.columnar import ColumnarSink
+
+SCHEMA = {'properties': {'id': {'type': ['null', 'number']},
+                         'name': {'type': ['null', 'string']}}}
+WINDOW = '2017-12-08T23:59:59+00:00'
+
+
+def rows(tmpdir):
+    found = []
+    for path in sorted(tmpdir.visit('*.csv.gz'), key=str):
+        with gzip.open(str(path), 'rt', newline='') as source:
+            found.extend(row[0] for row in list(csv.reader(source))[1:])
+    return found
+
+
+def test_closed_segments_survive_a_discard(tmpdir):
+    sink = ColumnarSink(str(tmpdir), ['Transactions', 'AggReport'], 'csv', batch_rows=2)
+    for number in range(3):
+        sink.write('Transactions', SCHEMA, WINDOW, {'id': number, 'name': 'a'})
+    sink.write('AggReport', SCHEMA, WINDOW, {'id': 10})
+    sink.close(WINDOW, 'Transactions')
+    sink.write('Transactions', SCHEMA, WINDOW, {'id': 3})
+    sink.discard(WINDOW, 'Transactions')
+    sink.write('Transactions', SCHEMA, WINDOW, {'id': 4})
+    sink.discard()
+    assert rows(tmpdir) == ['0', '1', '2']
+    assert not list(tmpdir.visit('*.tmp'))
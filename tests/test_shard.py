@@ -0,0 +1,37 @@
+from tap_awin.shard import mergestates, owns, parseshard
+
+
+def test_merge_resumes_from_the_shard_furthest_behind():
+    states = [{'shard': '0/2', 'last_fetched': '2017-12-09T23:59:59+00:00',
+               'bookmarks': {'2017-12-10T23:59:59+00:00': {'Transactions': ['advertiser/1']}}},
+              {'shard': '1/2', 'last_fetched': '2017-12-08T23:59:59+00:00',
+               'bookmarks': {'2017-12-09T23:59:59+00:00': {'Transactions': ['advertiser/2']},
+                             '2017-12-08T23:59:59+00:00': {'Transactions': ['advertiser/3']}}}]
+    merged = mergestates(states)
+    assert merged['last_fetched'] == '2017-12-08T23:59:59+00:00'
+    assert 'shard' not in merged
+    assert merged['bookmarks'] == {
+        '2017-12-09T23:59:59+00:00': {'Transactions': ['advertiser/2']},
+        '2017-12-10T23:59:59+00:00': {'Transactions': ['advertiser/1']}}
+
+
+def test_merge_unions_bookmarks_of_the_same_window():
+    window = '2017-12-09T23:59:59+00:00'
+    merged = mergestates([{'bookmarks': {window: {'AggReport': ['a', 'b']}}},
+                          {'bookmarks': {window: {'AggReport': ['b', 'c']}}}, {}])
+    assert merged == {'bookmarks': {window: {'AggReport': ['a', 'b', 'c']}}}
+
+
+def test_merge_restarts_when_a_shard_has_not_finished_a_window():
+    merged = mergestates([{'last_fetched': '2017-12-09T23:59:59+00:00', 'transactions': {}},
+                          {'transactions': {}}])
+    assert 'last_fetched' not in merged
+    assert mergestates([]) == {}
+
+
+def test_every_key_has_exactly_one_shard():
+    keys = ['advertiser/' + str(i) for i in range(200)]
+    owners = [[index for index in range(4) if owns((index, 4), key)] for key in keys]
+    assert all(len(owner) == 1 for owner in owners)
+    assert owns(None, 'advertiser/1')
+    assert parseshard('3/4') == (3, 4)
@@ -0,0 +1,43 @@
+from tap_awin.validate import compile_validator, RejectFile
+from tap_awin.writer import SingerWriter
+
+SCHEMA = {'properties': {'id': {'type': ['null', 'number']},
+                         'amount': {'type': ['null', 'number']},
+                         'count': {'type': ['integer']},
+                         'paid': {'type': ['null', 'boolean']},
+                         'name': {'type': ['null', 'string']}}}
+
+
+def test_coerces_values_in_place():
+    validate = compile_validator(SCHEMA)
+    record = {'id': '12', 'amount': '', 'count': '3', 'paid': 'TRUE', 'name': 5, 'extra': []}
+    assert validate(record) is None
+    assert record == {'id': 12, 'amount': None, 'count': 3, 'paid': True, 'name': '5',
+                      'extra': []}
+
+
+def test_reports_every_bad_field():
+    errors = compile_validator(SCHEMA)({'id': 'x', 'count': None, 'paid': 2, 'name': None})
+    assert [error.split(':')[0] for error in errors] == ['id', 'count', 'paid']
+
+
+def test_known_shapes_still_check_coerced_values():
+    validate = compile_validator(SCHEMA)
+    assert validate({'count': 1, 'name': 'a'}) is None
+    assert validate({'count': 2, 'name': 'b'}) is None
+    assert validate({'count': '1'}) is None
+    assert validate({'count': 'many'}) is not None
+    assert validate({'count': 1.5}) is not None
+    assert validate({'count': 'nan'}) is not None
+
+
+def test_invalid_records_are_only_dropped_into_a_reject_file(tmpdir):
+    path = str(tmpdir.join('rejects.jsonl'))
+    for rejects, written in [(None, True), (RejectFile(path), False)]:
+        writer = SingerWriter(validate=True, rejects=rejects)
+        writer.validators['s'] = compile_validator(SCHEMA)
+        assert writer.accept('s', {'count': '2'})
+        assert writer.accept('s', {'count': 'many', 'id': '1'}) is written
+        assert writer.rejected['s'] == 1
+    rejects.close()
+    assert len(tmpdir.join('rejects.jsonl').readlines()) == 1